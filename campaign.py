@@ -0,0 +1,100 @@
+"""
+Simulates the junctions of junction_coordinates.json in parallel on several carla/sumo instance
+pairs. Each slot is a carla_port:sumo_port pair: a carla server must be listening on carla_port,
+a sumo server is started on sumo_port for every junction.
+
+    python campaign.py --slots 2000:8813,3000:8823 --realtime-factor 0
+    python campaign.py --slots 2000:8813,3000:8823 --stand-in   # without carla and sumo
+
+The progress is recorded in <root_path>/.campaign/campaign.json, a restarted campaign only simulates the
+junctions that are not done.
+"""
+import json
+import argparse
+import glob
+import os
+import sys
+import logging
+import time
+
+from util.campaign import (LOG_FORMAT, CampaignManifest, add_simulation_args, campaign_path, parse_slots,
+                           run_campaign)
+
+
+def add_simulator_paths():
+    """
+    Adds the carla and traci modules to the system path, as main.py does.
+    """
+    carla_path = glob.glob('%s/PythonAPI/carla/dist/carla-*%d.%d-%s.egg' %
+                  (os.environ['CARLA_HOME'], sys.version_info.major, sys.version_info.minor,
+                   'win-amd64' if os.name == 'nt' else 'linux-x86_64'))
+    if len(carla_path) > 0:
+        sys.path.append(carla_path[0])
+    else:
+        raise ImportError('carla not found.')
+
+    if 'SUMO_HOME' in os.environ:
+        sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+    else:
+        sys.exit("please declare environment variable 'SUMO_HOME'")
+
+
+def pharse_args():
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_simulation_args(argparser)
+    argparser.add_argument('--slots',
+                           default='2000:8813',
+                           help='comma separated carla_port:sumo_port pairs, one worker per pair '
+                                '(default: 2000:8813)')
+    argparser.add_argument('--junctions',
+                           nargs='+',
+                           default=None,
+                           help='simulate only these junctions (default: all)')
+    argparser.add_argument('--stand-in',
+                           action='store_true',
+                           help='run a stand-in simulation writing fake data instead of carla and sumo')
+    args = argparser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    args = pharse_args()
+
+    # Load config file
+    with open(args.sensor_cfg_file) as json_file:
+        sensor_cfg = json.load(json_file)
+
+    if args.sync_vehicle_all is True:
+        args.sync_vehicle_lights = True
+        args.sync_vehicle_color = True
+
+    logging.basicConfig(format=LOG_FORMAT, level=logging.DEBUG if args.debug else logging.INFO)
+
+    if not args.stand_in:
+        add_simulator_paths()
+
+    with open(sensor_cfg['junction_info']) as junc_file:
+        junctions_info = json.load(junc_file)
+    if args.junctions is not None:
+        junctions_info = {junc_id: junctions_info[junc_id] for junc_id in args.junctions}
+
+    # Junctions completed by an earlier run of the campaign are skipped.
+    root_path = sensor_cfg['root_path']
+    os.makedirs(root_path, exist_ok=True)
+    os.makedirs(campaign_path(root_path), exist_ok=True)
+    manifest = CampaignManifest(campaign_path(root_path, 'campaign.json'), junctions_info)
+    unfinished = manifest.unfinished(junctions_info, root_path)
+    junctions_info = {junc_id: junctions_info[junc_id] for junc_id in unfinished}
+
+    slots = parse_slots(args.slots)
+    logging.info('Simulating %d junctions on %d slots (%d already done).', len(junctions_info), len(slots),
+                 manifest.count()['done'])
+    start = time.time()
+    results = run_campaign(args, sensor_cfg, junctions_info, slots, args.stand_in, manifest)
+
+    failed = sorted(junc_id for junc_id, result in results.items() if result['status'] != 'done')
+    logging.info('Campaign finished in %.1f s: %d done, %d failed %s, %d not run.', time.time() - start,
+                 len(results) - len(failed), len(failed), failed, len(junctions_info) - len(results))
+    logging.info('Manifest %s: %s', manifest.file_name, manifest.count())
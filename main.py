@@ -1,5 +1,4 @@
 import json
-import shutil
 import argparse
 import glob
 import os
@@ -31,6 +30,8 @@ else:
 # ==================================================================================================
 from util.util import write_sumocfg
 from run_synchronization import synchronization_loop
+from sumo_integration.carla_simulation import CarlaSession
+from util.campaign import CampaignManifest, add_simulation_args, campaign_path, finish_output, start_output
 
 # ==================================================================================================
 # -- main-------------------------------------------------------------------------------------------
@@ -38,14 +39,7 @@ from run_synchronization import synchronization_loop
 def pharse_args():
     argparser = argparse.ArgumentParser(description=__doc__)
     # argparser.add_argument('sumo_cfg_file', type=str, help='sumo configuration file')
-    argparser.add_argument('--sensor-cfg-file',
-                            metavar='C',
-                            default='config.json',
-                            help='Path for config files')
-    argparser.add_argument('--carla-host',
-                           metavar='H',
-                           default='127.0.0.1',
-                           help='IP of the carla host server (default: 127.0.0.1)')
+    add_simulation_args(argparser)
     argparser.add_argument('--carla-port',
                            metavar='P',
                            default=2000,
@@ -60,31 +54,6 @@ def pharse_args():
                            default=None,
                            type=int,
                            help='TCP port to liston to (default: 8813)')
-    argparser.add_argument('--sumo-gui', action='store_true', help='run the gui version of sumo')
-    argparser.add_argument('--step-length',
-                           default=0.1,
-                           type=float,
-                           help='set fixed delta seconds (default: 0.05s)')
-    argparser.add_argument('--client-order',
-                           metavar='TRACI_CLIENT_ORDER',
-                           default=1,
-                           type=int,
-                           help='client order number for the co-simulation TraCI connection (default: 1)')
-    argparser.add_argument('--sync-vehicle-lights',
-                           action='store_true',
-                           help='synchronize vehicle lights state (default: False)')
-    argparser.add_argument('--sync-vehicle-color',
-                           action='store_true',
-                           help='synchronize vehicle color (default: False)')
-    argparser.add_argument('--sync-vehicle-all',
-                           action='store_true',
-                           help='synchronize all vehicle properties (default: False)')
-    argparser.add_argument('--tls-manager',
-                           type=str,
-                           choices=['none', 'sumo', 'carla'],
-                           help="select traffic light manager (default: none)",
-                           default='none')
-    argparser.add_argument('--debug', action='store_true', help='enable debug messages')
     args = argparser.parse_args()
 
     return args
@@ -111,16 +80,32 @@ if __name__ == '__main__':
     root_path = sensor_cfg['root_path']
     # junctions = [x for x in os.walk(os.path.dirname(sensor_cfg['sumocfg']))][0][1]
 
-    for junc_id, junc_coor in junctions_info.items():
+    # Junctions completed by an earlier run are skipped, see .campaign/campaign.json.
+    os.makedirs(root_path, exist_ok=True)
+    os.makedirs(campaign_path(root_path), exist_ok=True)
+    manifest = CampaignManifest(campaign_path(root_path, 'campaign.json'), junctions_info)
+
+    # The carla map is loaded once and kept for all the junctions.
+    carla_session = CarlaSession(args.carla_host, args.carla_port)
+    for junc_id in manifest.unfinished(junctions_info, root_path):
+        junc_coor = junctions_info[junc_id]
         print("=============SIMULATION IN JUNCTION %s============" % junc_id)
-        # make dirs for saving data
+        # make dirs for saving data, the data is moved to data_path once the junction is done
         data_path = os.path.join(root_path, "j" + junc_id)
-        sensor_cfg['root_path'] = data_path
-        shutil.rmtree(data_path, ignore_errors=True)
-        os.makedirs(data_path)
+        sensor_cfg['root_path'] = start_output(data_path)
+        manifest.mark_running(junc_id)
+        start = time.time()
 
         # write sumo config file
         write_sumocfg(sensor_cfg['sumocfg'], junc_id)
         sensor_cfg['junc_coor'] = junc_coor
-        synchronization_loop(args, sensor_cfg)
+        try:
+            finished = synchronization_loop(args, sensor_cfg, carla_session)
+        except Exception as e:
+            manifest.mark_failed(junc_id, time.time() - start, repr(e))
+            raise
+        if finished:
+            manifest.mark_done(junc_id, time.time() - start, finish_output(data_path))
+        else:
+            manifest.mark_failed(junc_id, time.time() - start, 'cancelled')
         time.sleep(1.0)
\ No newline at end of file
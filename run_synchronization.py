@@ -11,15 +11,21 @@ Script to integrate CARLA and SUMO simulations
 
 
 import logging
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 # ==================================================================================================
 # -- sumo integration imports ----------------------------------------------------------------------
 # ==================================================================================================
 
+import carla  # pylint: disable=import-error
+
+from sumo_integration.actor_registry import CARLA_DRIVEN  # pylint: disable=wrong-import-position
 from sumo_integration.bridge_helper import BridgeHelper  # pylint: disable=wrong-import-position
 from sumo_integration.carla_simulation import CarlaSimulation  # pylint: disable=wrong-import-position
 from sumo_integration.constants import INVALID_ACTOR_ID  # pylint: disable=wrong-import-position
 from sumo_integration.sumo_simulation import SumoSimulation  # pylint: disable=wrong-import-position
+from util.profiler import TickProfiler  # pylint: disable=wrong-import-position
 
 # ==================================================================================================
 # -- synchronization_loop --------------------------------------------------------------------------
@@ -37,7 +43,9 @@ class SimulationSynchronization(object):
                  carla_simulation,
                  tls_manager='none',
                  sync_vehicle_color=False,
-                 sync_vehicle_lights=False):
+                 sync_vehicle_lights=False,
+                 profiler=None,
+                 pipelined=False):
         self.sensor_cfg = sensor_cfg
         self.sumo = sumo_simulation
         self.carla = carla_simulation
@@ -45,15 +53,28 @@ class SimulationSynchronization(object):
         self.tls_manager = tls_manager
         self.sync_vehicle_color = sync_vehicle_color
         self.sync_vehicle_lights = sync_vehicle_lights
+        self.profiler = profiler if profiler is not None else TickProfiler()
+
+        # In pipelined mode the next sumo step runs on a worker thread while carla ticks and the
+        # sensor data is saved. This is only possible while sumo does not depend on carla, i.e.
+        # there are no carla driven actors and carla does not manage the traffic lights.
+        self.pipelined = pipelined
+        self._sumo_worker = ThreadPoolExecutor(max_workers=1) if pipelined else None
+        self._sumo_step = None  # future of the sumo step running on the worker
+        self.finished = False
+
+        # Number of perception nodes whose sensors were spawned or stopped.
+        self.n_sensor_spawns = 0
+        self.n_sensor_stops = 0
 
         if tls_manager == 'carla':
             self.sumo.switch_off_traffic_lights()
         elif tls_manager == 'sumo':
             self.carla.switch_off_traffic_lights()
 
-        # Mapped actor ids.
-        self.sumo2carla_ids = {}  # Contains only actors controlled by sumo.
-        self.carla2sumo_ids = {}  # Contains only actors controlled by carla.
+        # Mapped actor ids and state of the synchronized actors. Actors controlled by carla have the
+        # CARLA_DRIVEN flag.
+        self.registry = self.sumo.registry
 
         BridgeHelper.blueprint_library = self.carla.world.get_blueprint_library()
         BridgeHelper.offset = sensor_cfg['offset']
@@ -72,7 +93,13 @@ class SimulationSynchronization(object):
         # -----------------
         # sumo-->carla sync
         # -----------------
-        self.sumo.tick()
+        if self._sumo_step is not None:
+            # The sumo step of this tick already ran during the previous carla tick.
+            with self.profiler.phase('sumo_wait'):
+                self._wait_sumo_step()
+        else:
+            with self.profiler.phase('sumo_tick'):
+                self.sumo.tick()
 
         # # Destroy all sensors if the number of sensors exceeds a certain amount
         # if self.carla.num_of_sensors() > 80:
@@ -82,141 +109,195 @@ class SimulationSynchronization(object):
 
         # Return if Simulation finished
         if self.sumo.ego_vehicle_state==2:
+            self.finished = True
             return
 
         # Spawning new sumo actors in carla (i.e, not controlled by carla).
-        sumo_spawned_actors = self.sumo.spawned_actors - set(self.carla2sumo_ids.values())
-        for sumo_actor_id in sumo_spawned_actors:
-            self.sumo.subscribe(sumo_actor_id)
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
-
-            carla_blueprint = BridgeHelper.get_carla_blueprint(sumo_actor, self.sync_vehicle_color)
-            if carla_blueprint is not None:
-                carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
-                                                                   sumo_actor.extent)
-
-                carla_actor_id = self.carla.spawn_actor(carla_blueprint, carla_transform)
-
-                if sumo_actor_id == self.sumo.ego_vehicle:
-                    self.carla.ego_vehicle_id = carla_actor_id
-                    ego_vehicle = self.carla.world.get_actor(carla_actor_id)
-                    extent = ego_vehicle.bounding_box.extent
-                    filename = self.sensor_cfg['root_path'] + "/" + str(carla_actor_id) + ".ego"
-                    with open(filename, 'w') as f:
-                        f.write('{:.3f}, {:.3f}, {:.3f}'.format(extent.x * 2, extent.y * 2, extent.y * 2, ))
-                        print('\nEgo id:', carla_actor_id)
-
-                if carla_actor_id != INVALID_ACTOR_ID:
-                    self.sumo2carla_ids[sumo_actor_id] = carla_actor_id
-            else:
-                self.sumo.unsubscribe(sumo_actor_id)
+        with self.profiler.phase('spawn_actors'):
+            # Actors spawned by carla are already registered.
+            sumo_spawned_actors = [sumo_actor_id for sumo_actor_id in self.sumo.spawned_actors
+                                   if sumo_actor_id not in self.registry]
+            for sumo_actor_id in sumo_spawned_actors:
+                self.sumo.subscribe(sumo_actor_id)
+                sumo_actor = self.sumo.get_actor(sumo_actor_id)
+
+                carla_blueprint = BridgeHelper.get_carla_blueprint(sumo_actor, self.sync_vehicle_color)
+                if carla_blueprint is not None:
+                    carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
+                                                                       sumo_actor.extent)
+
+                    carla_actor_id = self.carla.spawn_actor(carla_blueprint, carla_transform)
+
+                    if sumo_actor_id == self.sumo.ego_vehicle:
+                        self.carla.ego_vehicle_id = carla_actor_id
+                        ego_vehicle = self.carla.world.get_actor(carla_actor_id)
+                        extent = ego_vehicle.bounding_box.extent
+                        filename = self.sensor_cfg['root_path'] + "/" + str(carla_actor_id) + ".ego"
+                        with open(filename, 'w') as f:
+                            f.write('{:.3f}, {:.3f}, {:.3f}'.format(extent.x * 2, extent.y * 2, extent.y * 2, ))
+                            print('\nEgo id:', carla_actor_id)
+
+                    if carla_actor_id != INVALID_ACTOR_ID:
+                        self.registry.set_carla_id(sumo_actor_id, carla_actor_id)
+                else:
+                    self.sumo.unsubscribe(sumo_actor_id)
                 
         # if self.sumo.ego_vehicle_state==1:
         #     self.carla.synchronize_sensors()
 
         # Spawn sensors for perception nodes in carla
-        for sumo_actor_id in self.sumo.sensor_to_spawn:
-            if int(sumo_actor_id)<50:
-                carla_actor_id = self.sumo2carla_ids[sumo_actor_id]
-                self.carla.spawn_sensors_for(carla_actor_id)
+        with self.profiler.phase('spawn_sensors'):
+            for sumo_actor_id in self.sumo.sensor_to_spawn:
+                if int(sumo_actor_id)<50:
+                    carla_actor_id = self.registry.get_carla_id(sumo_actor_id)
+                    self.carla.spawn_sensors_for(carla_actor_id)
+                    self.n_sensor_spawns += 1
 
         # Stop sensors for perception nodes in carla
-        for sumo_actor_id in self.sumo.sensor_to_stop:
-            if int(sumo_actor_id) < 50:
-                carla_actor_id = self.sumo2carla_ids[sumo_actor_id]
-                self.carla.stop_sensors_for(carla_actor_id)
+        with self.profiler.phase('stop_sensors'):
+            for sumo_actor_id in self.sumo.sensor_to_stop:
+                if int(sumo_actor_id) < 50:
+                    carla_actor_id = self.registry.get_carla_id(sumo_actor_id)
+                    self.carla.stop_sensors_for(carla_actor_id)
+                    self.n_sensor_stops += 1
 
         # Destroying sumo arrived actors in carla.
-        if len(self.sumo.destroyed_actors) > 0:
-            print('Distroyed actors in carla:', self.sumo.destroyed_actors)
-            for sumo_actor_id in self.sumo.destroyed_actors:
-                if sumo_actor_id in self.sumo2carla_ids:
-                    self.carla.destroy_actor(self.sumo2carla_ids.pop(sumo_actor_id))
+        with self.profiler.phase('destroy_actors'):
+            if len(self.sumo.destroyed_actors) > 0:
+                print('Distroyed actors in carla:', self.sumo.destroyed_actors)
+                carla_actor_ids = [self.registry.remove(sumo_actor_id)
+                                   for sumo_actor_id in self.sumo.destroyed_actors
+                                   if not self.registry.has_flag(sumo_actor_id, CARLA_DRIVEN)]
+                self.carla.destroy_actors([carla_actor_id for carla_actor_id in carla_actor_ids
+                                           if carla_actor_id != INVALID_ACTOR_ID])
 
         # Updating sumo actors in carla.
-        for sumo_actor_id in self.sumo2carla_ids:
-            carla_actor_id = self.sumo2carla_ids[sumo_actor_id]
-
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
-            carla_actor = self.carla.get_actor(carla_actor_id)
+        with self.profiler.phase('sync_vehicles'):
+            # The poses of all the sumo driven actors spawned in carla are converted at once.
+            rows = self.registry.rows(exclude=CARLA_DRIVEN)
+            rows = rows[self.registry.carla_ids[rows] != INVALID_ACTOR_ID]
+            locations, rotations = BridgeHelper.get_carla_poses(self.registry.location[rows],
+                                                                self.registry.rotation[rows],
+                                                                self.registry.extent[rows])
+            vehicle_updates = []
+            for carla_actor_id, signals, location, rotation in zip(self.registry.carla_ids[rows].tolist(),
+                                                                   self.registry.signals[rows].tolist(),
+                                                                   locations.tolist(), rotations.tolist()):
+                carla_transform = carla.Transform(carla.Location(*location), carla.Rotation(*rotation))
+                if self.sync_vehicle_lights:
+                    # Only our own batches set the lights of sumo driven vehicles, no need to ask carla.
+                    carla_lights = BridgeHelper.get_carla_lights_state(
+                        self.carla.get_applied_light_state(carla_actor_id), signals)
+                else:
+                    carla_lights = None
 
-            carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
-                                                               sumo_actor.extent)
-            if self.sync_vehicle_lights:
-                carla_lights = BridgeHelper.get_carla_lights_state(carla_actor.get_light_state(),
-                                                                   sumo_actor.signals)
-            else:
-                carla_lights = None
+                vehicle_updates.append((carla_actor_id, carla_transform, carla_lights))
 
-            self.carla.synchronize_vehicle(carla_actor_id, carla_transform, carla_lights)
+            # All the transforms and light states of the tick are sent in one batch.
+            self.carla.synchronize_vehicles(vehicle_updates)
 
         # Updates traffic lights in carla based on sumo information.
-        if self.tls_manager == 'sumo':
-            common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
-            for landmark_id in common_landmarks:
-                sumo_tl_state = self.sumo.get_traffic_light_state(landmark_id)
-                carla_tl_state = BridgeHelper.get_carla_traffic_light_state(sumo_tl_state)
+        with self.profiler.phase('sync_traffic_lights'):
+            if self.tls_manager == 'sumo':
+                common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
+                for landmark_id in common_landmarks:
+                    sumo_tl_state = self.sumo.get_traffic_light_state(landmark_id)
+                    carla_tl_state = BridgeHelper.get_carla_traffic_light_state(sumo_tl_state)
 
-                self.carla.synchronize_traffic_light(landmark_id, carla_tl_state)
+                    self.carla.synchronize_traffic_light(landmark_id, carla_tl_state)
 
         # -----------------
         # carla-->sumo sync
         # -----------------
-        self.carla.tick()
+        if self._can_pipeline():
+            self._sumo_step = self._sumo_worker.submit(self._step_sumo)
+
+        with self.profiler.phase('carla_tick'):
+            self.carla.tick()
 
         # Spawning new carla actors (not controlled by sumo)
-        carla_spawned_actors = self.carla.spawned_actors - set(self.sumo2carla_ids.values())
-        for carla_actor_id in carla_spawned_actors:
-            carla_actor = self.carla.get_actor(carla_actor_id)
-
-            type_id = BridgeHelper.get_sumo_vtype(carla_actor)
-            color = carla_actor.attributes.get('color', None) if self.sync_vehicle_color else None
-            if type_id is not None:
-                sumo_actor_id = self.sumo.spawn_actor(type_id, color)
-                if sumo_actor_id != INVALID_ACTOR_ID:
-                    self.carla2sumo_ids[carla_actor_id] = sumo_actor_id
-                    self.sumo.subscribe(sumo_actor_id)
+        with self.profiler.phase('carla_spawn_actors'):
+            carla_spawned_actors = [carla_actor_id for carla_actor_id in self.carla.spawned_actors
+                                    if not self.registry.has_carla_id(carla_actor_id)]
+            if carla_spawned_actors and self._sumo_step is not None:
+                # Spawning in sumo needs the sumo connection, from now on we run in serial mode.
+                # The finished step is still consumed at the start of the next tick.
+                logging.info('Carla driven actors spawned, switching to serial mode.')
+                self._sumo_step.result()
+            for carla_actor_id in carla_spawned_actors:
+                carla_actor = self.carla.get_actor(carla_actor_id)
+
+                type_id = BridgeHelper.get_sumo_vtype(carla_actor)
+                color = carla_actor.attributes.get('color', None) if self.sync_vehicle_color else None
+                if type_id is not None:
+                    sumo_actor_id = self.sumo.spawn_actor(type_id, color)
+                    if sumo_actor_id != INVALID_ACTOR_ID:
+                        self.sumo.subscribe(sumo_actor_id)
+                        self.registry.set_carla_id(sumo_actor_id, carla_actor_id, CARLA_DRIVEN)
 
         # Destroying required carla actors in sumo.
-        for carla_actor_id in self.carla.destroyed_actors:
-            if carla_actor_id in self.carla2sumo_ids:
-                self.sumo.destroy_actor(self.carla2sumo_ids.pop(carla_actor_id))
+        with self.profiler.phase('carla_destroy_actors'):
+            for carla_actor_id in self.carla.destroyed_actors:
+                sumo_actor_id = self.registry.get_sumo_id(carla_actor_id)
+                if sumo_actor_id is not None and self.registry.has_flag(sumo_actor_id, CARLA_DRIVEN):
+                    self.sumo.destroy_actor(sumo_actor_id)
 
         # Updating carla actors in sumo.
-        for carla_actor_id in self.carla2sumo_ids:
-            sumo_actor_id = self.carla2sumo_ids[carla_actor_id]
-
-            carla_actor = self.carla.get_actor(carla_actor_id)
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
-
-            sumo_transform = BridgeHelper.get_sumo_transform(carla_actor.get_transform(),
-                                                             carla_actor.bounding_box.extent)
-            if self.sync_vehicle_lights:
-                carla_lights = self.carla.get_actor_light_state(carla_actor_id)
-                if carla_lights is not None:
-                    sumo_lights = BridgeHelper.get_sumo_lights_state(sumo_actor.signals,
-                                                                     carla_lights)
-                else:
-                    sumo_lights = None
-            else:
+        with self.profiler.phase('carla_sync_vehicles'):
+            for row in self.registry.rows(CARLA_DRIVEN):
+                sumo_actor_id = self.registry.sumo_ids[row]
+                carla_actor_id = int(self.registry.carla_ids[row])
+                sumo_signals = int(self.registry.signals[row])
+
+                carla_actor = self.carla.get_actor(carla_actor_id)
+
+                sumo_transform = BridgeHelper.get_sumo_transform(carla_actor.get_transform(),
+                                                                 carla_actor.bounding_box.extent)
                 sumo_lights = None
+                if self.sync_vehicle_lights:
+                    # Carla driven vehicles are lit by their own client, their light state has to be
+                    # read from carla. Sumo is only updated when it changes.
+                    carla_lights = self.carla.get_actor_light_state(carla_actor_id)
+                    if carla_lights is not None:
+                        sumo_lights = BridgeHelper.get_sumo_lights_state(sumo_signals, carla_lights)
+                        if sumo_lights == sumo_signals:
+                            sumo_lights = None
 
-            self.sumo.synchronize_vehicle(sumo_actor_id, sumo_transform, sumo_lights)
+                self.sumo.synchronize_vehicle(sumo_actor_id, sumo_transform, sumo_lights)
 
         # Updates traffic lights in sumo based on carla information.
-        if self.tls_manager == 'carla':
-            common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
-            for landmark_id in common_landmarks:
-                carla_tl_state = self.carla.get_traffic_light_state(landmark_id)
-                sumo_tl_state = BridgeHelper.get_sumo_traffic_light_state(carla_tl_state)
+        with self.profiler.phase('carla_sync_traffic_lights'):
+            if self.tls_manager == 'carla':
+                common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
+                for landmark_id in common_landmarks:
+                    carla_tl_state = self.carla.get_traffic_light_state(landmark_id)
+                    sumo_tl_state = BridgeHelper.get_sumo_traffic_light_state(carla_tl_state)
+
+                    # Updates all the sumo links related to this landmark.
+                    self.sumo.synchronize_traffic_light(landmark_id, sumo_tl_state)
+
+    def _can_pipeline(self):
+        return self.pipelined and not self.registry.ids(CARLA_DRIVEN) and self.tls_manager != 'carla'
 
-                # Updates all the sumo links related to this landmark.
-                self.sumo.synchronize_traffic_light(landmark_id, sumo_tl_state)
+    def _step_sumo(self):
+        with self.profiler.phase('sumo_tick'):
+            self.sumo.tick()
+
+    def _wait_sumo_step(self):
+        """
+        Waits for the sumo step running on the worker. Re-raises its exception, if any.
+        """
+        sumo_step, self._sumo_step = self._sumo_step, None
+        sumo_step.result()
 
     def close(self):
         """
         Cleans synchronization.
         """
+        # Let a pending sumo step finish before the connections are closed.
+        if self._sumo_worker is not None:
+            self._sumo_worker.shutdown(wait=True)
+            self._sumo_step = None
         # Configuring carla simulation in async mode.
         settings = self.carla.world.get_settings()
         settings.synchronous_mode = False
@@ -224,50 +305,78 @@ class SimulationSynchronization(object):
         self.carla.world.apply_settings(settings)
 
         self.carla.close()
+        logging.info('Perception nodes (%s selection): sensors spawned %d times, stopped %d times.',
+                     self.sumo.node_selection, self.n_sensor_spawns, self.n_sensor_stops)
+        # The sensor writers are done now, the report covers all the threads.
+        if self.profiler.enabled:
+            self.profiler.write_report(os.path.join(self.sensor_cfg['root_path'], 'profile.json'))
+        if self.profiler.trace:
+            self.profiler.write_trace(os.path.join(self.sensor_cfg['root_path'], 'profile_trace.json'))
         # Destroying synchronized actors.
         # for carla_actor_id in self.sumo2carla_ids.values():
         #     self.carla.destroy_actor(carla_actor_id)
 
-        for sumo_actor_id in self.carla2sumo_ids.values():
+        for sumo_actor_id in self.registry.ids(CARLA_DRIVEN):
             self.sumo.destroy_actor(sumo_actor_id)
         logging.info('Destroyed synchronized actors in sumo.')
         # Closing sumo and carla client.
         self.sumo.close()
 
 
-def synchronization_loop(args, sensor_cfg):
+def synchronization_loop(args, sensor_cfg, carla_session=None):
     """
-    Entry point for sumo-carla co-simulation.
+    Entry point for sumo-carla co-simulation. Pass the same carla_session for consecutive junctions
+    to keep the loaded map.
+
+        :return: True if the simulation finished, False if it was cancelled by the user.
     """
     sumo_simulation = SumoSimulation(sensor_cfg['sumocfg'], args.step_length, args.sumo_host,
                                      args.sumo_port, args.sumo_gui, args.client_order,
-                                     ego_vehicle_id='10', comm_range=sensor_cfg['communication_range'])
+                                     ego_vehicle_id='10', comm_range=sensor_cfg['communication_range'],
+                                     n_samples=sensor_cfg.get('n_samples', 5),
+                                     node_selection=sensor_cfg.get('node_selection'),
+                                     backend=args.sumo_backend)
     sensor_cfg['offset'] = sumo_simulation.get_net_offset()
-    carla_simulation = CarlaSimulation(args.carla_host, args.carla_port, args.step_length, sensor_cfg)
+    profiler = TickProfiler(args.profile, args.profile_trace)
+    carla_simulation = CarlaSimulation(args.carla_host, args.carla_port, args.step_length, sensor_cfg,
+                                       profiler, carla_session)
 
     synchronization = SimulationSynchronization(sensor_cfg, sumo_simulation, carla_simulation, args.tls_manager,
-                                                args.sync_vehicle_color, args.sync_vehicle_lights)
+                                                args.sync_vehicle_color, args.sync_vehicle_lights, profiler,
+                                                args.pipelined)
+    # Each tick is paced to last step_length / realtime_factor seconds, 0 runs unpaced.
+    tick_period = args.step_length / args.realtime_factor if args.realtime_factor > 0 else 0.0
+    n_ticks = 0
+    loop_start = time.time()
     try:
         while True:
             start = time.time()
 
-            synchronization.tick()
-            if synchronization.sumo.ego_vehicle_state==2:
+            with profiler.phase('tick'):
+                synchronization.tick()
+            n_ticks += 1
+            # In pipelined mode the sumo state may already belong to the next step.
+            if synchronization.finished:
                 logging.info('Finish simulation.')
                 break
 
             end = time.time()
             elapsed = end - start
-            if elapsed < args.step_length:
-                time.sleep(args.step_length - elapsed)
+            if elapsed < tick_period:
+                time.sleep(tick_period - elapsed)
 
     except KeyboardInterrupt:
         logging.info('Cancelled by user.')
 
     finally:
+        wall_time = time.time() - loop_start
+        logging.info('Simulated %.1f s in %.1f s wall time (%.2f simulated s per wall s, %d ticks).',
+                     n_ticks * args.step_length, wall_time,
+                     n_ticks * args.step_length / max(wall_time, 1e-9), n_ticks)
         logging.info('Cleaning synchronization')
         synchronization.close()
         logging.info('Done. ')
+    return synchronization.finished
 
 
 
@@ -4,6 +4,7 @@ import random
 import os
 import csv
 import shutil
+from util.campaign import junction_dirs
 
 
 def read_vtypes(filename):
@@ -21,8 +22,8 @@ def read_vtypes(filename):
 
 def write_bbox(data_path, vtypes_file, out_path):
     vtypes_cls, vtypes_size = read_vtypes(vtypes_file)
-    # get all junctions
-    junctions = os.listdir(data_path)
+    # get all finished junctions
+    junctions = junction_dirs(data_path)
     for junc in junctions:
         info_file = os.path.join(data_path, junc, 'info.csv')
         with open(info_file, 'r') as fh:
@@ -0,0 +1,142 @@
+"""
+Benchmarks the selection of the perception nodes (util/sampling.py) against the previous python
+implementations of SumoSimulation.update_perception_nodes_fps and update_perception_nodes_geo, and
+checks that both pick the same vehicles. Then counts the node changes (sensor spawns and stops) of
+the fps and hysteresis selections on vehicles moving in the communication range.
+
+    python -m scripts.python.bench_fps
+    python -m scripts.python.bench_fps --vehicles 10 50 200 --samples 5 10 --repeat 20
+"""
+import argparse
+import time
+
+import numpy as np
+
+from util.sampling import HysteresisSampler, sample_actors
+
+
+def legacy_fps(locations, ego, n_samples):
+    if len(locations) <= n_samples:
+        return set(locations.keys())
+    solution_set = [ego]
+    remaining_points = list(locations.keys())
+    remaining_points.remove(ego)
+
+    def distance(a, b):
+        return np.linalg.norm(np.array(a) - np.array(b))
+
+    for _ in range(n_samples - 1):
+        distances = [distance(locations[p], locations[solution_set[0]]) for p in remaining_points]
+        for i, p in enumerate(remaining_points):
+            for s in solution_set:
+                distances[i] = min(distances[i], distance(locations[p], locations[s]))
+        solution_set.append(remaining_points.pop(distances.index(max(distances))))
+    return set(solution_set)
+
+
+def legacy_geo(locations, ego, n_samples):
+    choosen = [ego]
+    not_choosen = list(locations.keys())
+    not_choosen.remove(ego)
+    for _ in range(n_samples):
+        max_dist = 0
+        max_idx = -1
+        for k in not_choosen:
+            min_dist = min([np.linalg.norm(np.array(locations[actor]) - np.array(locations[k])) for actor in choosen])
+            if max_dist < min_dist:
+                max_dist = min_dist
+                max_idx = k
+        if max_idx != -1:
+            choosen.append(max_idx)
+            not_choosen.remove(max_idx)
+    return set(choosen)
+
+
+def fps(locations, ego, n_samples):
+    if len(locations) <= n_samples:
+        return set(locations.keys())
+    return sample_actors(locations, ego, n_samples)
+
+
+def geo(locations, ego, n_samples):
+    return sample_actors(locations, ego, n_samples + 1, distinct=True)
+
+
+def random_locations(n_vehicles, comm_range, seed):
+    """
+    Vehicles uniformly spread in the communication range of the ego vehicle '0', as returned by
+    SumoSimulation.get_in_range_actors.
+    """
+    rng = np.random.RandomState(seed)
+    radius = comm_range * np.sqrt(rng.uniform(size=n_vehicles))
+    angle = rng.uniform(0.0, 2.0 * np.pi, size=n_vehicles)
+    points = np.stack([radius * np.cos(angle), radius * np.sin(angle)], axis=1)
+    points[0] = 0.0
+    return {str(i): list(point) for i, point in enumerate(points)}
+
+
+def timeit(func, scenes, n_samples):
+    start = time.perf_counter()
+    results = [func(locations, '0', n_samples) for locations in scenes]
+    return (time.perf_counter() - start) * 1000.0 / len(scenes), results
+
+
+def churn(n_vehicles, n_samples, n_ticks, comm_range, step_length=0.1, seed=0):
+    """
+    Moves the vehicles around the ego vehicle at random constant velocities (vehicles leaving the
+    range reappear on the other side) and counts the node spawns and stops of each selection.
+    """
+    rng = np.random.RandomState(seed)
+    points = np.array(list(random_locations(n_vehicles, comm_range, seed).values()))
+    velocities = rng.uniform(-15.0, 15.0, size=points.shape)
+    velocities[0] = 0.0
+    sampler = HysteresisSampler(n_samples)
+    counts = {'fps': [0, 0], 'hysteresis': [0, 0]}
+    last = {'fps': set(), 'hysteresis': set()}
+    for tick in range(n_ticks):
+        points = points + velocities * step_length
+        outside = np.linalg.norm(points, axis=1) > comm_range
+        points[outside] = -points[outside] * 0.99
+        locations = {str(i): list(point) for i, point in enumerate(points)}
+        for name, picked in [('fps', fps(locations, '0', n_samples)),
+                             ('hysteresis', sampler.select(locations, '0', tick))]:
+            counts[name][0] += len(picked - last[name])
+            counts[name][1] += len(last[name] - picked)
+            last[name] = picked
+    return counts
+
+
+def main(vehicles, samples, repeat, comm_range, n_ticks):
+    print('%8s %8s %6s %14s %14s %8s %6s' % ('vehicles', 'samples', 'method', 'legacy ms', 'numpy ms',
+                                             'speedup', 'same'))
+    for n_vehicles in vehicles:
+        scenes = [random_locations(n_vehicles, comm_range, seed) for seed in range(repeat)]
+        for n_samples in samples:
+            for name, legacy, new in [('fps', legacy_fps, fps), ('geo', legacy_geo, geo)]:
+                legacy_ms, expected = timeit(legacy, scenes, n_samples)
+                new_ms, results = timeit(new, scenes, n_samples)
+                print('%8d %8d %6s %14.3f %14.3f %8.1f %6s' % (n_vehicles, n_samples, name, legacy_ms, new_ms,
+                                                               legacy_ms / new_ms, results == expected))
+
+    print('\n%d ticks' % n_ticks)
+    print('%8s %8s %12s %12s %14s %14s' % ('vehicles', 'samples', 'fps spawns', 'fps stops',
+                                           'hyst. spawns', 'hyst. stops'))
+    for n_vehicles in vehicles:
+        for n_samples in samples:
+            counts = churn(n_vehicles, n_samples, n_ticks, comm_range)
+            print('%8d %8d %12d %12d %14d %14d' % ((n_vehicles, n_samples) + tuple(counts['fps']) +
+                                                   tuple(counts['hysteresis'])))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--vehicles', nargs='+', default=[10, 30, 50, 200], type=int,
+                           help='number of vehicles in range of the ego vehicle (default: 10 30 50 200)')
+    argparser.add_argument('--samples', nargs='+', default=[5, 10], type=int,
+                           help='number of perception nodes (default: 5 10)')
+    argparser.add_argument('--repeat', default=10, type=int, help='number of random scenes (default: 10)')
+    argparser.add_argument('--ticks', default=500, type=int, help='number of ticks of the churn test (default: 500)')
+    argparser.add_argument('--range', default=50.0, type=float, help='communication range in meters (default: 50)')
+    args = argparser.parse_args()
+    main(args.vehicles, args.samples, args.repeat, args.range, args.ticks)
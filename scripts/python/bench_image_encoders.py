@@ -0,0 +1,88 @@
+"""
+Benchmarks the camera image encoders (util/image_io.py): encode ms/frame, decode ms/frame and
+bytes/frame at the image size of the cameras config block.
+
+    python -m scripts.python.bench_image_encoders --frames 20
+    python -m scripts.python.bench_image_encoders --image /path/to/000123.png
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from util.image_io import get_extension, read_image, write_image
+
+ENCODERS = [
+    {'type': 'png', 'compress_level': 1},
+    {'type': 'png', 'compress_level': 6},
+    {'type': 'png', 'compress_level': 9},
+    {'type': 'npy'},
+    {'type': 'jpeg', 'quality': 90},
+    {'type': 'webp', 'method': 0},
+    {'type': 'webp', 'method': 4},
+]
+
+
+def synthetic_image(height, width, seed):
+    """
+    Smooth gradients with some blocks and noise, closer to rendered frames than uniform noise.
+    """
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.stack([x * 255.0 / width, y * 255.0 / height, (x + y) * 127.0 / (width + height)], axis=2)
+    for _ in range(20):
+        r0, c0 = rng.randint(0, height - 50), rng.randint(0, width - 50)
+        image[r0:r0 + rng.randint(10, 50), c0:c0 + rng.randint(10, 50)] = rng.randint(0, 255, size=3)
+    image += rng.normal(0.0, 4.0, size=image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def run(encoder, images, out_path):
+    encode_times = []
+    decode_times = []
+    n_bytes = 0
+    for i, image in enumerate(images):
+        file_name = os.path.join(out_path, '%06d.%s' % (i, get_extension(encoder)))
+        start = time.perf_counter()
+        write_image(image, file_name, encoder)
+        encode_times.append(time.perf_counter() - start)
+        n_bytes += os.path.getsize(file_name)
+
+        start = time.perf_counter()
+        np.array(read_image(file_name))
+        decode_times.append(time.perf_counter() - start)
+    return np.mean(encode_times) * 1000.0, np.mean(decode_times) * 1000.0, n_bytes / len(images)
+
+
+def main(n_frames, config_file, image_file=None):
+    if image_file is not None:
+        images = [np.array(read_image(image_file))[:, :, :3]] * n_frames
+    else:
+        with open(config_file) as f:
+            camera_cfg = json.load(f)['cameras'][0]
+        images = [synthetic_image(camera_cfg['image_size_y'], camera_cfg['image_size_x'], i)
+                  for i in range(n_frames)]
+
+    out_path = tempfile.mkdtemp()
+    try:
+        print('%d frames of %dx%d' % (n_frames, images[0].shape[1], images[0].shape[0]))
+        print('%-40s %12s %12s %14s' % ('encoder', 'encode ms', 'decode ms', 'bytes/frame'))
+        for encoder in ENCODERS:
+            encode_ms, decode_ms, n_bytes = run(encoder, images, out_path)
+            print('%-40s %12.2f %12.2f %14.0f' % (json.dumps(encoder), encode_ms, decode_ms, n_bytes))
+    finally:
+        shutil.rmtree(out_path)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--frames', default=20, type=int, help='number of frames (default: 20)')
+    argparser.add_argument('--config', default='config.json', help='config file with the camera settings')
+    argparser.add_argument('--image', default=None, help='encode this image instead of synthetic frames')
+    args = argparser.parse_args()
+    main(args.frames, args.config, args.image)
@@ -0,0 +1,88 @@
+"""
+Benchmarks the per-frame cost of pointcloud_callback for the '.pcd' (colorized Open3D cloud) and the
+'.bin' (raw x, y, z, intensity buffer) output formats on synthetic lidar frames.
+
+    python -m scripts.python.bench_lidar_callback --frames 50
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from util.util import pointcloud_callback
+
+
+class _Location(object):
+    x, y, z = 10.0, 20.0, 1.5
+
+
+class _Rotation(object):
+    roll, pitch, yaw = 0.0, 0.0, 90.0
+
+
+class _Transform(object):
+    location = _Location()
+    rotation = _Rotation()
+
+
+class FakeLidarMeasurement(object):
+    """
+    Stand-in for carla.LidarMeasurement with random points.
+    """
+    def __init__(self, frame, n_points, channels):
+        points = np.random.uniform(-70.0, 70.0, size=(n_points, 4)).astype(np.float32)
+        points[:, 3] = np.random.uniform(0.1, 1.0, size=n_points)
+        self.raw_data = points.tobytes()
+        self.frame = frame
+        self.timestamp = frame * 0.1
+        self.transform = _Transform()
+        self.horizontal_angle = 0.0
+        self.channels = channels
+        self._counts = np.full(channels, n_points // channels)
+
+    def get_point_count(self, channel):
+        return int(self._counts[channel])
+
+
+def run(file_format, frames, out_path):
+    times = []
+    n_bytes = 0
+    for frame in frames:
+        file_name = os.path.join(out_path, '%06d.%s' % (frame.frame, file_format))
+        start = time.perf_counter()
+        pointcloud_callback(frame, file_name=file_name, file_format=file_format)
+        times.append(time.perf_counter() - start)
+        n_bytes += os.path.getsize(file_name)
+    times = np.array(times) * 1000.0
+    return {'ms_per_frame': float(times.mean()), 'p95_ms': float(np.percentile(times, 95)),
+            'bytes_per_frame': n_bytes / len(frames)}
+
+
+def main(n_frames, config_file):
+    with open(config_file) as f:
+        lidar_cfg = json.load(f)['lidars'][0]
+    n_points = int(lidar_cfg['points_per_second'] / lidar_cfg['rotation_frequency'])
+    frames = [FakeLidarMeasurement(i, n_points, lidar_cfg['channels']) for i in range(n_frames)]
+
+    out_path = tempfile.mkdtemp()
+    try:
+        print('%d frames, %d points per frame' % (n_frames, n_points))
+        for file_format in ['pcd', 'bin']:
+            result = run(file_format, frames, out_path)
+            print('%s: %.2f ms/frame (p95 %.2f ms), %.0f bytes/frame' % (
+                file_format, result['ms_per_frame'], result['p95_ms'], result['bytes_per_frame']))
+    finally:
+        shutil.rmtree(out_path)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--frames', default=50, type=int, help='number of frames (default: 50)')
+    argparser.add_argument('--config', default='config.json', help='config file with the lidar settings')
+    args = argparser.parse_args()
+    main(args.frames, args.config)
@@ -0,0 +1,115 @@
+"""
+Benchmarks the sumo ticks per second with traci (sumo process, socket connection) and libsumo
+(sumo in this process) on the bundled Town05 routes. Each tick steps sumo and runs the queries of
+SumoSimulation.tick: departed and arrived vehicles, subscription results of all the vehicles decoded
+into an ActorRegistry and the context subscription of the ego vehicle.
+
+    python -m scripts.python.bench_sumo_backend --ticks 2000
+    python -m scripts.python.bench_sumo_backend --sumocfg traffic_flow/town5/Town05_965.sumocfg --scale 3
+
+SUMO_HOME must be set. Without --sumocfg a config with traffic_flow/town5/Town5.rou.xml is used.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+if 'SUMO_HOME' in os.environ:
+    sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+import sumolib  # pylint: disable=import-error,wrong-import-position
+import traci.constants as tc  # pylint: disable=import-error,wrong-import-position
+
+from sumo_integration.actor_registry import ActorRegistry  # pylint: disable=wrong-import-position
+from sumo_integration.sumo_backend import select_backend, traci  # pylint: disable=wrong-import-position
+
+TOWN5_PATH = os.path.join('traffic_flow', 'town5')
+
+# Variables subscribed by SumoSimulation.subscribe.
+VEHICLE_VARIABLES = [tc.VAR_TYPE, tc.VAR_VEHICLECLASS, tc.VAR_COLOR, tc.VAR_LENGTH, tc.VAR_WIDTH,
+                     tc.VAR_HEIGHT, tc.VAR_POSITION3D, tc.VAR_ANGLE, tc.VAR_SLOPE, tc.VAR_SPEED,
+                     tc.VAR_SIGNALS]
+
+
+def write_bench_sumocfg(path):
+    town5_path = os.path.abspath(TOWN5_PATH)
+    with open(path, 'w') as f:
+        f.write("""<?xml version="1.0" encoding="UTF-8"?>
+<configuration>
+    <input>
+        <net-file value="{}"/>
+        <route-files value="{},{}"/>
+    </input>
+</configuration>
+""".format(os.path.join(town5_path, 'Town05.net.xml'),
+           os.path.join(os.path.dirname(town5_path), 'carlavtypes_all.rou.xml'),
+           os.path.join(town5_path, 'Town5.rou.xml')))
+
+
+def run(backend, sumocfg, n_ticks, step_length, scale, ego_vehicle='0', comm_range=50.0):
+    select_backend(backend)
+    traci.start([sumolib.checkBinary('sumo'),
+                 '--configuration-file', sumocfg,
+                 '--step-length', str(step_length),
+                 '--lateral-resolution', '0.25',
+                 '--collision.check-junctions',
+                 '--scale', str(scale),
+                 '--no-step-log', '--no-warnings'])
+    registry = ActorRegistry()
+    try:
+        start = time.perf_counter()
+        for tick in range(n_ticks):
+            traci.simulationStep()
+            registry.update(traci.vehicle.getAllSubscriptionResults())
+            departed = traci.simulation.getDepartedIDList()
+            for vehicle in traci.simulation.getArrivedIDList():
+                registry.remove(vehicle)
+            for vehicle in departed:
+                traci.vehicle.subscribe(vehicle, VEHICLE_VARIABLES)
+                registry.add(vehicle)
+                registry.update({vehicle: traci.vehicle.getSubscriptionResults(vehicle)}, static=True)
+                if vehicle == ego_vehicle:
+                    traci.vehicle.subscribeContext(ego_vehicle, tc.CMD_GET_VEHICLE_VARIABLE, comm_range,
+                                                   [tc.VAR_POSITION, tc.VAR_VEHICLECLASS])
+            if ego_vehicle in registry:
+                traci.vehicle.getContextSubscriptionResults(ego_vehicle)
+            if traci.simulation.getMinExpectedNumber() == 0:
+                n_ticks = tick + 1
+                break
+        elapsed = time.perf_counter() - start
+    finally:
+        traci.close()
+    return n_ticks, elapsed
+
+
+def main(backends, sumocfg, n_ticks, step_length, scale):
+    # Without a config, the bench config is written to a temporary directory, never to the tree.
+    with tempfile.TemporaryDirectory() as tmp_path:
+        if sumocfg is None:
+            sumocfg = os.path.join(tmp_path, 'bench_backend.sumocfg')
+            write_bench_sumocfg(sumocfg)
+        print('%-8s %8s %10s %10s' % ('backend', 'ticks', 'seconds', 'ticks/s'))
+        for backend in backends:
+            try:
+                ticks, elapsed = run(backend, sumocfg, n_ticks, step_length, scale)
+            except ImportError as error:
+                print('%-8s %s' % (backend, error))
+                continue
+            print('%-8s %8d %10.2f %10.1f' % (backend, ticks, elapsed, ticks / elapsed))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--backends', nargs='+', default=['traci', 'libsumo'], choices=['traci', 'libsumo'],
+                           help='backends to compare (default: traci libsumo)')
+    argparser.add_argument('--sumocfg', default=None, help='sumo config (default: the Town5.rou.xml routes)')
+    argparser.add_argument('--ticks', default=2000, type=int,
+                           help='maximum number of ticks, the run stops when all vehicles arrived (default: 2000)')
+    argparser.add_argument('--step-length', default=0.1, type=float, help='sumo step length (default: 0.1s)')
+    argparser.add_argument('--scale', default=1.0, type=float, help='sumo demand scale factor (default: 1)')
+    args = argparser.parse_args()
+    main(args.backends, args.sumocfg, args.ticks, args.step_length, args.scale)
@@ -0,0 +1,122 @@
+"""
+Materializes the legacy <vehicle_id>/<sensor>/<frame>.png|pcd tree (with the '_meta.txt' files) from
+the sensor journal of a junction run (see util/journal.py).
+"""
+import argparse
+import os
+
+import numpy as np
+import open3d as o3d
+from PIL import Image
+from tqdm import tqdm
+
+from util.color_encoding import LABEL_COLORS
+from util.image_io import labels_to_palette
+from util.journal import SensorJournalReader
+from util.pointcloud_io import SEMANTIC_LIDAR_DTYPE
+from util.vis import intensity_to_color
+
+
+def write_image_meta(filename, record):
+    lines = [','.join([str(int(record['frame'])), str(float(record['timestamp'])), str(float(record['fov'])),
+                       str(int(record['height'])), str(int(record['width']))]),
+             ','.join([str(float(record[k])) for k in ['roll', 'pitch', 'yaw', 'x', 'y', 'z']])]
+    with open(filename[:-4] + '_meta.txt', 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def write_lidar_meta(filename, record):
+    channels = int(record['channels'])
+    lines = [','.join([str(int(record['frame'])), str(float(record['timestamp'])),
+                       str(float(record['horizontal_angle'])), str(channels)]),
+             ','.join([str(float(record[k])) for k in ['roll', 'pitch', 'yaw', 'x', 'y', 'z']]),
+             ','.join([str(int(c)) for c in record['point_counts'][:channels]])]
+    with open(filename[:-4] + '_meta.txt', 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def export_image(record, payload, filename, is_annotation=False):
+    array = np.frombuffer(payload, dtype=np.uint8)
+    if np.all(array == 0):
+        return False
+    array = np.reshape(array, (int(record['height']), int(record['width']), 4))
+    if is_annotation:
+        # Same output as carla's CityScapesPalette conversion of the BGRA buffer (label in red).
+        array = labels_to_palette(array[:, :, 2])
+    Image.fromarray(np.ascontiguousarray(array[:, :, :3])).save(filename)
+    write_image_meta(filename, record)
+    return True
+
+
+def export_lidar(record, payload, filename, lidar_format='pcd'):
+    data = np.frombuffer(payload, dtype=np.float32)
+    if np.all(data == 0):
+        return False
+    if lidar_format == 'bin':
+        with open(filename, 'wb') as f:
+            f.write(payload)
+    else:
+        data = np.reshape(data, (int(data.shape[0] / 4), 4))
+        points = np.array(data[:, :-1])
+        points[:, :1] = -points[:, :1]
+        point_list = o3d.geometry.PointCloud()
+        point_list.points = o3d.utility.Vector3dVector(points)
+        point_list.colors = o3d.utility.Vector3dVector(intensity_to_color(data[:, -1]))
+        o3d.io.write_point_cloud(filename, point_list)
+    write_lidar_meta(filename, record)
+    return True
+
+
+def export_semantic_lidar(record, payload, filename, lidar_format='pcd'):
+    data = np.frombuffer(payload, dtype=SEMANTIC_LIDAR_DTYPE)
+    points = np.array([data['x'], -data['y'], data['z']]).T
+    if np.all(points == 0):
+        return False
+    if lidar_format == 'bin':
+        with open(filename, 'wb') as f:
+            f.write(payload)
+    else:
+        point_list = o3d.geometry.PointCloud()
+        point_list.points = o3d.utility.Vector3dVector(points)
+        point_list.colors = o3d.utility.Vector3dVector((LABEL_COLORS / 255.0)[data['ObjTag']])
+        o3d.io.write_point_cloud(filename, point_list)
+    write_lidar_meta(filename, record)
+    return True
+
+
+def main(in_path, out_path, lidar_format='pcd'):
+    reader = SensorJournalReader(os.path.join(in_path, 'journal'))
+    for sensor_name in reader.sensor_names:
+        if 'camera' in sensor_name:
+            ext = 'png'
+        else:
+            ext = lidar_format
+        index = reader.indexes[sensor_name]
+        n_written = 0
+        for row in tqdm(range(len(index)), desc=sensor_name):
+            record, payload = reader.get_record(sensor_name, row)
+            data_path = os.path.join(out_path, '%06d' % record['parent_id'], sensor_name)
+            if not os.path.exists(data_path):
+                os.makedirs(data_path)
+            filename = os.path.join(data_path, '%06d.%s' % (record['frame'], ext))
+            if sensor_name == 'camera':
+                written = export_image(record, payload, filename)
+            elif sensor_name == 'camera_sem':
+                written = export_image(record, payload, filename, is_annotation=True)
+            elif sensor_name == 'lidar':
+                written = export_lidar(record, payload, filename, lidar_format)
+            else:
+                written = export_semantic_lidar(record, payload, filename, lidar_format)
+            n_written += int(written)
+        print('%s: exported %d of %d frames' % (sensor_name, n_written, len(index)))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('in_path', help='junction directory containing the "journal" folder')
+    argparser.add_argument('--out-path', default=None,
+                           help='root of the exported tree (default: the junction directory)')
+    argparser.add_argument('--lidar-format', choices=['pcd', 'bin'], default='pcd',
+                           help='file format of the exported lidar frames (default: pcd)')
+    args = argparser.parse_args()
+    main(args.in_path, args.out_path or args.in_path, args.lidar_format)
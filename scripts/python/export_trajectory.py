@@ -0,0 +1,41 @@
+"""
+Exports the binary trajectory file of a junction (config "trajectory_format": "bin") to the legacy
+info.csv read by bbox.py, formatting_data.py, validate.py and the MATLAB scripts.
+
+    python -m scripts.python.export_trajectory <rootdir>/j<junction>
+    python -m scripts.python.export_trajectory <rootdir>/j<junction>/trajectory.bin --out /tmp/info.csv
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from util.trajectory import INFO_CSV_HEADER, TrajectoryReader, format_info_row
+
+
+def export_info_csv(trajectory_file, out_file):
+    reader = TrajectoryReader(trajectory_file)
+    values = np.stack([reader.rows[name].astype(np.float64) for name in
+                       ['x', 'y', 'z', 'roll', 'pitch', 'yaw', 'length', 'width', 'height']], axis=1)
+    with open(out_file, 'w') as fh:
+        file_writer = csv.writer(fh, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        file_writer.writerow(INFO_CSV_HEADER)
+        for row, type_id, row_values in zip(reader.rows, reader.type_ids(reader.rows), values):
+            file_writer.writerow(format_info_row(row['frame'], type_id, row['vehicle_id'], row_values))
+    return len(reader)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('path', help='junction directory or trajectory.bin file')
+    argparser.add_argument('--out', default=None, help='output file (default: info.csv next to trajectory.bin)')
+    args = argparser.parse_args()
+
+    trajectory_file = args.path
+    if os.path.isdir(trajectory_file):
+        trajectory_file = os.path.join(trajectory_file, 'trajectory.bin')
+    out_file = args.out if args.out is not None else os.path.join(os.path.dirname(trajectory_file), 'info.csv')
+    n_rows = export_info_csv(trajectory_file, out_file)
+    print('%d rows written to %s' % (n_rows, out_file))
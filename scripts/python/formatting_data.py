@@ -5,6 +5,9 @@ import open3d as o3d
 import xml.etree.ElementTree as ET
 import shutil
 from util.color_encoding import LABEL_COLORS
+from util.pointcloud_io import read_semantic_lidar_bin, semantic_lidar_points, write_compact
+from util.meta_log import MetaLogReader
+from util.campaign import junction_dirs
 from tqdm import tqdm
 from scipy.spatial.transform import Rotation as R
 
@@ -51,23 +54,38 @@ def get_tf_matrix(rot, loc):
     return tf_mat
 
 
-def write_cloud_ego(cloud, out_file):
-    points_ego_np = np.array(cloud.points).astype(np.float32)
-    # find point label
-    colors_ego_np = (np.array(cloud.colors) * 255).astype(np.uint8)
-    labels = np.where(np.all(colors_ego_np[:, :, None] == LABEL_COLORS.T[None, :, :], axis=1))[1]
-    point_array = np.concatenate([points_ego_np, labels.reshape(-1, 1).astype(np.float32)], axis=1)
-    point_array.astype('float32').tofile(out_file)
+def decode_labels(cloud):
+    ## get point-wise semantic label from the colors of a '.pcd' cloud
+    colors_np = (np.array(cloud.colors) * 255).astype(np.uint8)
+    dists = np.abs(colors_np[:, :, None] - LABEL_COLORS.T[None, :, :]).sum(axis=1)
+    return np.argmin(dists, axis=1)
+
+
+def read_cloud(filename):
+    """Reads a semantic lidar file ('.pcd' or raw '.bin') and returns the cloud and its labels"""
+    if filename.endswith('.bin'):
+        points, labels = semantic_lidar_points(read_semantic_lidar_bin(filename))
+        cloud = o3d.geometry.PointCloud()
+        cloud.points = o3d.utility.Vector3dVector(points)
+        return cloud, labels
+    cloud = o3d.io.read_point_cloud(filename)
+    return cloud, decode_labels(cloud)
 
 
-def write_cloud_fused(clouds, cloud_ego, meta_info_list, meta_info_ego, out_path, voxel_size=0.1):
+def write_cloud_ego(cloud, labels, out_file, resolution=None):
+    save_cloud_to_bin(cloud, labels, out_file, resolution)
+
+
+def write_cloud_fused(clouds, labels_list, cloud_ego, labels_ego, meta_info_list, meta_info_ego,
+                      out_path, voxel_size=0.1, resolution=None):
+    ext = '.bin' if resolution is None else '.cbin'
     tf_ego = get_tf_matrix(*meta_info_ego[2:4])
     tfs_dict = {'tf_ego': tf_ego}
     # transform clouds to the coordinate of ego lidar
     points_out = []
-    points_out_colors = []
+    points_out_labels = []
     points_out.append(np.array(cloud_ego.points))
-    points_out_colors.append(np.array(cloud_ego.colors))
+    points_out_labels.append(labels_ego)
 
     for i, meta_info in enumerate(meta_info_list):
         tf = get_tf_matrix(*meta_info[2:4])
@@ -76,36 +94,51 @@ def write_cloud_fused(clouds, cloud_ego, meta_info_list, meta_info_ego, out_path
         # transform clouds to ego-vehicle lidar frame
         cloud = clouds[i].transform(tf).transform(np.linalg.inv(tf_ego))
         # save original and transformed points of neighbors before fusing
-        save_cloud_to_bin(cloud, out_path.format('cloud_coop_in_egoCS', v_id + '.bin'))
-        save_cloud_to_bin(clouds[i], out_path.format('cloud_coop', v_id + '.bin'))
+        save_cloud_to_bin(cloud, labels_list[i], out_path.format('cloud_coop_in_egoCS', v_id + ext), resolution)
+        save_cloud_to_bin(clouds[i], labels_list[i], out_path.format('cloud_coop', v_id + ext), resolution)
         points_out.append(np.array(cloud.points))
-        points_out_colors.append(np.array(cloud.colors))
+        points_out_labels.append(labels_list[i])
 
     # fuse and save
     pcd = o3d.geometry.PointCloud()
     point_array = np.concatenate(points_out, axis=0)
-    point_colors_array = np.concatenate(points_out_colors, axis=0)
+    point_labels_array = np.concatenate(points_out_labels, axis=0)
     pcd.points = o3d.utility.Vector3dVector(point_array)
-    pcd.colors = o3d.utility.Vector3dVector(point_colors_array)
     bound = np.ones((3, 1), dtype=np.float64) * voxel_size
     cloud_fused, map, inds = o3d.geometry.PointCloud\
         .voxel_down_sample_and_trace(pcd, voxel_size, bound, bound)
+    labels_fused = majority_labels(inds, point_labels_array)
     # write binary file
-    save_cloud_to_bin(cloud_fused, out_path.format('cloud_fused', '.bin'))
+    save_cloud_to_bin(cloud_fused, labels_fused, out_path.format('cloud_fused', ext), resolution)
 
     # save tfs
     np.save(out_path.format('tfs', '.npy'), tfs_dict)
 
 
-def save_cloud_to_bin(cloud, filename):
+def majority_labels(inds, labels):
+    ## each voxel takes the most frequent label of the points it contains (the lowest label on ties).
+    ## inds: indices of the points of each voxel, as traced by voxel_down_sample_and_trace
+    sizes = np.array([len(ind) for ind in inds], dtype=np.int64)
+    if sizes.sum() == 0:
+        return np.zeros(len(sizes), dtype=np.int64)
+    point_inds = np.concatenate([np.asarray(ind, dtype=np.int64) for ind in inds])
+    point_voxels = np.repeat(np.arange(len(sizes)), sizes)
+    point_labels = np.asarray(labels, dtype=np.int64)[point_inds]
+    # (voxel, label) counts in one pass over all the points
+    n_labels = int(point_labels.max()) + 1
+    counts = np.bincount(point_voxels * n_labels + point_labels, minlength=len(sizes) * n_labels)
+    return counts.reshape(len(sizes), n_labels).argmax(axis=1)
+
+
+def save_cloud_to_bin(cloud, labels, filename, resolution=None):
+    ## with a resolution, write the quantized compact format instead (util.pointcloud_io.write_compact)
+    if resolution is not None:
+        write_compact(filename, np.array(cloud.points), labels, resolution)
+        return
     ## get points' coordinates
     points_np = np.array(cloud.points).astype(np.float32)
-    ## get point-wise semantic label
-    colors_np = (np.array(cloud.colors) * 255).astype(np.uint8)
-    dists = np.abs(colors_np[:, :, None] - LABEL_COLORS.T[None, :, :]).sum(axis=1)
-    labels = np.argmin(dists, axis=1).reshape(-1, 1)
     ## append label to the point as the 4-th element and add the labeled points to list
-    points = np.concatenate([points_np, labels.astype(np.float32)], axis=1)
+    points = np.concatenate([points_np, labels.reshape(-1, 1).astype(np.float32)], axis=1)
     ## write binary file
     points.astype('float32').tofile(filename)
 
@@ -138,6 +171,26 @@ def read_meta_info(meta_file):
         return frame, id, rot, loc, channels
 
 
+def read_meta_log_info(meta_log, frame_file, sensor_name='lidar_sem'):
+    """Same as read_meta_info, but looks the frame up in the binary meta log of the junction"""
+    id = frame_file.split('/')[-3]
+    frame = frame_file.split('/')[-1][:-4]
+    record = meta_log.find(int(frame), int(id), sensor_name)
+    if record is None:
+        raise ValueError('No meta information for frame %s of vehicle %s.' % (frame, id))
+    rot = - np.array([record['roll'], record['pitch'], record['yaw']], dtype=np.float64) / 180 * np.pi
+    loc = np.array([[record['x']], [-record['y']], [record['z']]], dtype=np.float64)
+    channels = np.array(record['point_counts'][:record['channels']], dtype=np.int32)
+
+    return str(record['frame']), id, rot, loc, channels
+
+
+def get_meta_info(frame_file, meta_log=None):
+    if meta_log is not None:
+        return read_meta_log_info(meta_log, frame_file)
+    return read_meta_info(frame_file[:-4] + '_meta.txt')
+
+
 def write_bbox(info_file, vtypes_file, out_path, ego_vehicle_id):
     vtypes_cls, vtypes_size = read_vtypes(vtypes_file)
     with open(info_file, 'r') as fh:
@@ -195,7 +248,7 @@ def write_bbox(info_file, vtypes_file, out_path, ego_vehicle_id):
 
 
 def write_ego_vehicle_info(in_path, out_path):
-    files = glob.glob(in_path + '/*/*.ego')
+    files = [f for junc in junction_dirs(in_path) for f in glob.glob(os.path.join(in_path, junc, '*.ego'))]
     with open(os.path.join(out_path, 'ego_info.txt'), 'w') as fo:
         for file in files:
             junction = file.split('/')[-2][1:]
@@ -204,7 +257,9 @@ def write_ego_vehicle_info(in_path, out_path):
             fo.write(junction + ',' + line + '\n')
 
 
-def main(in_path, out_path, vtypes_file):
+def main(in_path, out_path, vtypes_file, resolution=None):
+    # resolution: if given, clouds are written as compact '.cbin' files quantized to this step (meters)
+    ext = '.bin' if resolution is None else '.cbin'
     # create dirs for saving data
     shutil.rmtree(out_path, ignore_errors=True)
     dirs = ['cloud_ego', 'cloud_fused', 'label_box',
@@ -214,8 +269,8 @@ def main(in_path, out_path, vtypes_file):
 
     write_ego_vehicle_info(in_path, out_path)
 
-    # get all junctions
-    junctions = os.listdir(in_path)
+    # get all finished junctions
+    junctions = junction_dirs(in_path)
 
     for junc in junctions:
         print('junction: %s \n' % junc)
@@ -227,23 +282,30 @@ def main(in_path, out_path, vtypes_file):
         for d in dirs:
             if 'ego' in d:
                 ego_vehicle_id = d[:-4].zfill(6)
-            elif 'csv' not in d:
+            elif os.path.isdir(os.path.join(in_path, junc, d)):
                 vehicles.append(d)
 
+        # meta information is either in '_meta.txt' files or in the binary meta log of the junction
+        meta_log_file = os.path.join(in_path, junc, 'meta.bin')
+        meta_log = MetaLogReader(meta_log_file) if os.path.exists(meta_log_file) else None
+
         info_file = os.path.join(in_path, junc, 'info.csv')
         write_bbox(info_file, vtypes_file, os.path.join(out_path, 'label_box', junc[1:]), ego_vehicle_id)
 
         # find all valid frames of ego vehicle and the corresponding neighbors
-        frames = glob.glob(os.path.join(in_path, junc, ego_vehicle_id, 'lidar_sem', '*.pcd'))
+        # ('.pcd' clouds or raw '.bin' semantic lidar dumps)
+        frames = glob.glob(os.path.join(in_path, junc, ego_vehicle_id, 'lidar_sem', '*.pcd')) \
+                 + glob.glob(os.path.join(in_path, junc, ego_vehicle_id, 'lidar_sem', '*.bin'))
 
         for frame in tqdm(frames):
             filename = os.path.join(out_path, '{}', junc[1:] + '_'
                                     + frame.split('/')[-1][:-4] + '{}')
-            pcd_ego = o3d.io.read_point_cloud(frame)
-            meta_info_ego = read_meta_info(frame.replace('.pcd', '_meta.txt'))
+            pcd_ego, labels_ego = read_cloud(frame)
+            meta_info_ego = get_meta_info(frame, meta_log)
 
             # write fused point clouds
             clouds = []
+            labels = []
             meta_infos = []
             for v in vehicles:
                 if v==ego_vehicle_id:
@@ -252,15 +314,18 @@ def main(in_path, out_path, vtypes_file):
                 pcd_file[-3] = v
                 pcd_file = '/'.join(pcd_file)
                 if os.path.exists(pcd_file):
-                    clouds.append(o3d.io.read_point_cloud(pcd_file))
-                    meta_infos.append(read_meta_info(pcd_file.replace('.pcd', '_meta.txt')))
+                    cloud, cloud_labels = read_cloud(pcd_file)
+                    clouds.append(cloud)
+                    labels.append(cloud_labels)
+                    meta_infos.append(get_meta_info(pcd_file, meta_log))
 
             # write point clouds to binary files
             if len(clouds) > 0:
-                write_cloud_ego(pcd_ego, filename.format('cloud_ego', '.bin'))
+                write_cloud_ego(pcd_ego, labels_ego, filename.format('cloud_ego', ext), resolution)
                 os.makedirs(filename.format('cloud_coop', ''))
                 os.makedirs(filename.format('cloud_coop_in_egoCS', ''))
-                write_cloud_fused(clouds, pcd_ego, meta_infos, meta_info_ego, filename)
+                write_cloud_fused(clouds, labels, pcd_ego, labels_ego, meta_infos, meta_info_ego, filename,
+                                  resolution=resolution)
 
 
 if __name__ == "__main__":
@@ -268,4 +333,5 @@ if __name__ == "__main__":
     in_path = "/media/hdd/yuan/koko/data/simulation"
     file_vtypes = os.path.join(cur_dir, "../../data/carlavtypes.rou.xml")
     out_path = "/media/hdd/yuan/koko/data/synthdata"
-    main(in_path, out_path, file_vtypes)
+    resolution = None  # e.g. 0.003 to write compact '.cbin' clouds quantized to 3 mm (int16 up to +-98 m)
+    main(in_path, out_path, file_vtypes, resolution)
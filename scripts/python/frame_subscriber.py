@@ -0,0 +1,102 @@
+"""
+Reference consumer of the live sensor frames published by the simulation ("publisher" config
+block). Decodes every frame and reports the publish-to-receive latency and the lost frames.
+
+    python -m scripts.python.frame_subscriber --name cosense_frames
+    python -m scripts.python.frame_subscriber --synthetic 200   # without carla, fake lidar frames
+"""
+import argparse
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from util.meta_log import SENSOR_NAMES
+from util.publisher import FramePublisher, FrameSubscriber, decode_frame
+
+
+def report(latencies, n_lost):
+    latencies = np.array(latencies) * 1000.0
+    print('%d frames, %d lost, latency ms: mean %.3f, p50 %.3f, p95 %.3f, max %.3f' % (
+        len(latencies), n_lost, latencies.mean(), np.percentile(latencies, 50),
+        np.percentile(latencies, 95), latencies.max()))
+
+
+def subscribe(name, n_frames=None, report_every=100):
+    subscriber = FrameSubscriber(name)
+    latencies = []
+    try:
+        while n_frames is None or len(latencies) < n_frames:
+            frame = subscriber.poll()
+            if frame is None:
+                time.sleep(0.0005)
+                continue
+            header, payload = frame
+            points, labels = decode_frame(header, payload)
+            latencies.append(time.time() - header['publish_time'])
+            if len(latencies) % report_every == 0:
+                print('frame %d vehicle %d %s: %s' % (header['frame'], header['parent_id'],
+                                                     SENSOR_NAMES[header['sensor_type']], points.shape))
+                report(latencies[-report_every:], subscriber.n_lost)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
+    if len(latencies) > 0:
+        report(latencies, subscriber.n_lost)
+
+
+class _FakeLidarMeasurement(object):
+    """
+    Stand-in for carla.LidarMeasurement with random points.
+    """
+    class _Transform(object):
+        class location(object):
+            x, y, z = 10.0, 20.0, 1.5
+
+        class rotation(object):
+            roll, pitch, yaw = 0.0, 0.0, 90.0
+
+    def __init__(self, n_points):
+        self.raw_data = np.random.uniform(-70.0, 70.0, size=(n_points, 4)).astype(np.float32).tobytes()
+        self.frame = 0
+        self.timestamp = 0.0
+        self.transform = self._Transform()
+
+
+def synthetic(name, n_frames, n_points, rate):
+    frames = [_FakeLidarMeasurement(n_points) for _ in range(8)]
+    publisher = FramePublisher(name, sensor_names=['lidar'])
+    # The subscriber runs in its own interpreter, as a perception model would.
+    process = subprocess.Popen([sys.executable, '-m', 'scripts.python.frame_subscriber',
+                                '--name', name, '--frames', str(n_frames)])
+    time.sleep(2.0)
+    try:
+        for i in range(n_frames):
+            frame = frames[i % len(frames)]
+            frame.frame, frame.timestamp = i, i * 0.05
+            publisher.publish('lidar', 1, 100 + i % 4, frame)
+            time.sleep(1.0 / rate)
+    finally:
+        time.sleep(0.5)
+        process.send_signal(signal.SIGINT)
+        process.wait()
+        publisher.close()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--name', default='cosense_frames', help='shared memory name of the publisher')
+    argparser.add_argument('--frames', default=None, type=int, help='stop after this many frames')
+    argparser.add_argument('--synthetic', default=None, type=int, metavar='N',
+                           help='publish N fake lidar frames in this process instead of attaching to the simulation')
+    argparser.add_argument('--points', default=20000, type=int, help='points per synthetic frame (default: 20000)')
+    argparser.add_argument('--rate', default=100.0, type=float, help='synthetic frames per second (default: 100)')
+    args = argparser.parse_args()
+    if args.synthetic is not None:
+        synthetic(args.name + '_synthetic', args.synthetic, args.points, args.rate)
+    else:
+        subscribe(args.name, args.frames)
@@ -0,0 +1,35 @@
+"""
+Renders the semantic camera label maps of a junction run (cameras "label_format": "label") with the
+CityScapes palette, for visualization.
+
+    python -m scripts.python.render_labels /path/to/j1050 /path/to/out
+"""
+import argparse
+import glob
+import os
+
+from tqdm import tqdm
+
+from util.image_io import labels_to_palette, read_image, write_image
+
+
+def main(in_path, out_path):
+    files = [f for f in glob.glob(os.path.join(in_path, '*', 'camera_sem', '*'))
+             if not f.endswith('_meta.txt')]
+    for file_name in tqdm(files):
+        labels = read_image(file_name)
+        vehicle_id = file_name.split('/')[-3]
+        frame = os.path.splitext(os.path.basename(file_name))[0]
+        out_dir = os.path.join(out_path, vehicle_id)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        write_image(labels_to_palette(labels), os.path.join(out_dir, frame + '.png'))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('in_path', help='junction directory of the simulation data')
+    argparser.add_argument('out_path', help='directory for the rendered images')
+    args = argparser.parse_args()
+    main(args.in_path, args.out_path)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+""" This module keeps the state of the co-simulated actors in numpy columns. """
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import numpy as np
+
+import traci.constants as tc  # pylint: disable=import-error
+
+from .constants import INVALID_ACTOR_ID
+
+# ==================================================================================================
+# -- actor registry --------------------------------------------------------------------------------
+# ==================================================================================================
+
+# Role flags of an actor.
+CARLA_DRIVEN = 1 << 0  # driven by carla, mirrored in sumo
+IN_RANGE = 1 << 1  # in communication range of the ego vehicle
+PERCEPTION = 1 << 2  # node of the collective perception network
+EGO = 1 << 3
+
+
+def _decode_color(value):
+    """
+    libsumo returns subscribed colors as a TraCIResult, e.g. 'TraCIColor(255,255,0,255)'.
+    """
+    if hasattr(value, 'getString'):
+        return [int(channel) for channel in value.getString().split('(')[1].rstrip(')').split(',')]
+    return value
+
+
+class ActorRegistry(object):
+    """
+    ActorRegistry holds the sumo subscribed actors as a struct of arrays: one row per actor, rows of
+    removed actors are reused. It maps sumo ids and carla ids to rows in O(1), and decodes the sumo
+    subscription results of all the actors of a tick into the columns at once.
+
+    Columns (sumo reference system): location (front bumper x, y, z), rotation (slope, angle, 0),
+    extent (half length, width, height), speed, signals, color (RGBA), type_ids, vclasses, carla_ids
+    and flags.
+    """
+    def __init__(self, capacity=64):
+        self.sumo_ids = np.empty(capacity, dtype=object)
+        self.carla_ids = np.full(capacity, INVALID_ACTOR_ID, dtype=np.int64)
+        self.type_ids = np.empty(capacity, dtype=object)
+        self.vclasses = np.empty(capacity, dtype=object)
+        self.location = np.zeros((capacity, 3))
+        self.rotation = np.zeros((capacity, 3))
+        self.extent = np.zeros((capacity, 3))
+        self.speed = np.zeros(capacity)
+        self.signals = np.zeros(capacity, dtype=np.int32)
+        self.color = np.zeros((capacity, 4), dtype=np.uint8)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.active = np.zeros(capacity, dtype=bool)
+
+        self._sumo_rows = {}
+        self._carla_rows = {}
+        self._free_rows = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._sumo_rows)
+
+    def __contains__(self, sumo_id):
+        return sumo_id in self._sumo_rows
+
+    def _grow(self):
+        capacity = len(self.sumo_ids)
+        for name in ['sumo_ids', 'carla_ids', 'type_ids', 'vclasses', 'location', 'rotation', 'extent',
+                     'speed', 'signals', 'color', 'flags', 'active']:
+            column = getattr(self, name)
+            if name == 'carla_ids':
+                grown = np.full(2 * capacity, INVALID_ACTOR_ID, dtype=column.dtype)
+            elif column.dtype == object:
+                grown = np.empty(2 * capacity, dtype=object)
+            else:
+                grown = np.zeros((2 * capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:capacity] = column
+            setattr(self, name, grown)
+        self._free_rows = list(range(2 * capacity - 1, capacity - 1, -1)) + self._free_rows
+
+    def add(self, sumo_id, carla_id=INVALID_ACTOR_ID, flags=0):
+        """
+        Adds a row for the given sumo actor, or returns its row if it is already registered.
+        """
+        row = self._sumo_rows.get(sumo_id)
+        if row is not None:
+            return row
+        if not self._free_rows:
+            self._grow()
+        row = self._free_rows.pop()
+        self.sumo_ids[row] = sumo_id
+        self.flags[row] = flags
+        self.active[row] = True
+        self._sumo_rows[sumo_id] = row
+        self.set_carla_id(sumo_id, carla_id)
+        return row
+
+    def remove(self, sumo_id):
+        """
+        Removes the given sumo actor, if registered.
+            :return: its carla id (INVALID_ACTOR_ID if it had none or is not registered).
+        """
+        row = self._sumo_rows.pop(sumo_id, None)
+        if row is None:
+            return INVALID_ACTOR_ID
+        carla_id = int(self.carla_ids[row])
+        self._carla_rows.pop(carla_id, None)
+        self.sumo_ids[row] = None
+        self.carla_ids[row] = INVALID_ACTOR_ID
+        self.type_ids[row] = None
+        self.vclasses[row] = None
+        self.flags[row] = 0
+        self.active[row] = False
+        self._free_rows.append(row)
+        return carla_id
+
+    def row(self, sumo_id):
+        return self._sumo_rows[sumo_id]
+
+    def set_carla_id(self, sumo_id, carla_id, flags=0):
+        row = self._sumo_rows[sumo_id]
+        self._carla_rows.pop(int(self.carla_ids[row]), None)
+        self.carla_ids[row] = carla_id
+        self.flags[row] |= flags
+        if carla_id != INVALID_ACTOR_ID:
+            self._carla_rows[carla_id] = row
+
+    def get_carla_id(self, sumo_id):
+        row = self._sumo_rows.get(sumo_id)
+        return INVALID_ACTOR_ID if row is None else int(self.carla_ids[row])
+
+    def get_sumo_id(self, carla_id):
+        row = self._carla_rows.get(carla_id)
+        return None if row is None else self.sumo_ids[row]
+
+    def has_carla_id(self, carla_id):
+        return carla_id in self._carla_rows
+
+    def rows(self, flags=0, exclude=0):
+        """
+        Rows of the registered actors having all the given flags and none of the excluded ones.
+        """
+        mask = self.active & ((self.flags & flags) == flags)
+        if exclude:
+            mask &= (self.flags & exclude) == 0
+        return np.flatnonzero(mask)
+
+    def ids(self, flags=0, exclude=0):
+        """
+        Sumo ids of the registered actors having all the given flags and none of the excluded ones.
+        """
+        return list(self.sumo_ids[self.rows(flags, exclude)])
+
+    def set_flag(self, flag, sumo_ids):
+        """
+        Sets the flag on the given actors (unregistered ones are skipped) and clears it on the others.
+        """
+        self.flags &= ~np.uint8(flag)
+        rows = [self._sumo_rows[sumo_id] for sumo_id in sumo_ids if sumo_id in self._sumo_rows]
+        self.flags[rows] |= np.uint8(flag)
+
+    def has_flag(self, sumo_id, flag):
+        row = self._sumo_rows.get(sumo_id)
+        return row is not None and bool(self.flags[row] & flag)
+
+    def update(self, results, static=False):
+        """
+        Decodes subscription results into the columns. Results of unregistered actors are skipped.
+
+            :param results: {sumo_id: {variable: value}}, as returned by
+                            traci.vehicle.getAllSubscriptionResults().
+            :param static: also decode the type, class, size and color, which only change when the
+                           actor is modified (set when the actor is subscribed).
+        """
+        rows = []
+        values = []
+        for sumo_id, variables in results.items():
+            row = self._sumo_rows.get(sumo_id)
+            if row is not None and variables:
+                rows.append(row)
+                values.append(variables)
+        if not rows:
+            return
+
+        # x, y, z, slope, angle, speed, signals. Vehicles off the road (e.g. teleporting) report an
+        # invalid 2d position.
+        state = np.array([(variables[tc.VAR_POSITION3D] + (0.0,))[:3] +
+                          (variables[tc.VAR_SLOPE], variables[tc.VAR_ANGLE], variables[tc.VAR_SPEED],
+                           variables[tc.VAR_SIGNALS])
+                          for variables in values])
+        self.location[rows] = state[:, 0:3]
+        self.rotation[rows, 0:2] = state[:, 3:5]
+        self.speed[rows] = state[:, 5]
+        self.signals[rows] = state[:, 6]
+
+        # The static columns are also decoded the first time an actor has results.
+        if not static:
+            first = [i for i, row in enumerate(rows) if self.type_ids[row] is None]
+            rows = [rows[i] for i in first]
+            values = [values[i] for i in first]
+        if rows:
+            self.type_ids[rows] = [variables[tc.VAR_TYPE] for variables in values]
+            self.vclasses[rows] = [variables[tc.VAR_VEHICLECLASS] for variables in values]
+            self.extent[rows] = np.array([(variables[tc.VAR_LENGTH], variables[tc.VAR_WIDTH], variables[tc.VAR_HEIGHT])
+                                          for variables in values]) / 2.0
+            self.color[rows] = [_decode_color(variables[tc.VAR_COLOR]) for variables in values]
@@ -20,6 +20,8 @@ import sys
 import glob
 import os
 
+import numpy as np
+
 try:
     sys.path.append(
         glob.glob('../../PythonAPI/carla/dist/carla-*%d.%d-%s.egg' %
@@ -29,8 +31,8 @@ except IndexError:
     pass
 
 import carla  # pylint: disable=import-error
-import traci  # pylint: disable=import-error
 
+from .sumo_backend import traci
 from .sumo_simulation import SumoSignalState, SumoVehSignal
 
 # ==================================================================================================
@@ -77,6 +79,29 @@ class BridgeHelper(object):
 
         return out_transform
 
+    @staticmethod
+    def get_carla_poses(sumo_location, sumo_rotation, extent):
+        """
+        Vectorized get_carla_transform for N actors.
+
+            :param sumo_location: N x 3 front-center-bumper locations in the sumo reference system.
+            :param sumo_rotation: N x 3 (pitch, yaw, roll) in the sumo reference system.
+            :param extent: N x 3 bounding box extents.
+            :return: N x 3 carla locations and N x 3 carla (pitch, yaw, roll).
+        """
+        offset = BridgeHelper.offset
+        yaw = np.radians(90.0 - sumo_rotation[:, 1])
+        pitch = np.radians(sumo_rotation[:, 0])
+
+        location = np.empty_like(sumo_location)
+        location[:, 0] = sumo_location[:, 0] - np.cos(yaw) * extent[:, 0] - offset[0]
+        location[:, 1] = -(sumo_location[:, 1] - np.sin(yaw) * extent[:, 0] - offset[1])
+        location[:, 2] = sumo_location[:, 2] - np.sin(pitch) * extent[:, 0]
+
+        rotation = sumo_rotation.copy()
+        rotation[:, 1] -= 90.0
+        return location, rotation
+
     @staticmethod
     def get_sumo_transform(in_carla_transform, extent):
         """
@@ -15,8 +15,15 @@ import logging
 
 import carla  # pylint: disable=import-error
 from util.util import *
+from util.sensor_writer import SensorWriterPool
+from util.meta_log import MetaLog
+from util.journal import SensorJournal
+from util.image_io import get_encoder, get_extension
+from util.sensor_buffer import SensorFrameBuffer
+from util.publisher import FramePublisher
+from util.profiler import TickProfiler
+from util.trajectory import INFO_CSV_HEADER, TrajectoryRecorder, format_info_row
 from .constants import INVALID_ACTOR_ID, SPAWN_OFFSET_Z
-import queue
 import os
 import functools
 import csv
@@ -26,28 +33,88 @@ import csv
 # ==================================================================================================
 
 
-def _get_data_callback(sensor_name):
+def _get_data_callback(sensor_name, cfg):
+    lidar_format = cfg['lidars'][0].get('format', 'pcd')
     try:
         return {
-            'camera': image_callback,
-            'camera_sem': functools.partial(image_callback, is_annotation=True),
-            'lidar': pointcloud_callback,
-            'lidar_sem': semantic_lidar_callback
+            'camera': functools.partial(image_callback,
+                                        encoder=get_encoder(cfg['cameras'][0], 'camera')),
+            'camera_sem': functools.partial(image_callback, is_annotation=True,
+                                            encoder=get_encoder(cfg['cameras'][0], 'camera_sem'),
+                                            label_map=cfg['cameras'][0].get('label_format') == 'label'),
+            'lidar': functools.partial(pointcloud_callback, file_format=lidar_format),
+            'lidar_sem': functools.partial(semantic_lidar_callback, file_format=lidar_format)
         }[sensor_name]
 
     except:
         raise ("No sensor named {}.".format(sensor_name))
 
 
-class CarlaSimulation(object):
+def _get_file_extension(sensor_name, cfg):
+    if 'camera' in sensor_name:
+        return get_extension(get_encoder(cfg['cameras'][0], sensor_name))
+    if 'lidar' in sensor_name and cfg['lidars'][0].get('format', 'pcd') == 'bin':
+        return 'bin'
+    return 'pcd'
+
+
+class CarlaSession(object):
     """
-    CarlaSimulation is responsible for the management of the carla simulation.
+    CarlaSession keeps the carla client and the loaded world across the junctions simulated on the
+    same server. The map is loaded only for the first junction or when the town changes, and the
+    landmark to traffic light table is built once per loaded map.
     """
-    def __init__(self, host, port, step_length, cfg):
+    def __init__(self, host, port):
         self.client = carla.Client(host, port)
         self.client.set_timeout(60.0)
 
-        self.world = self.client.load_world('Town05')
+        self.town = None
+        self.world = None
+        self._tls = None
+
+    def get_world(self, town):
+        """
+        Returns the world of the given town, loading it if needed.
+        """
+        if self.world is None or town != self.town:
+            logging.info('Loading carla map %s.', town)
+            self.world = self.client.load_world(town)
+            self.town = town
+            self._tls = None
+        else:
+            # Traffic lights frozen by a previous junction (see switch_off_traffic_lights).
+            for actor in self.world.get_actors().filter('traffic.traffic_light'):
+                actor.freeze(False)
+        return self.world
+
+    def get_traffic_lights(self):
+        """
+        Returns the traffic lights of the loaded map.
+            :returns dict: {landmark_id: traffic_light_actor}
+        """
+        if self._tls is None:
+            self._tls = {}
+            tmp_map = self.world.get_map()
+            for landmark in tmp_map.get_all_landmarks_of_type('1000001'):
+                if landmark.id != '':
+                    traffic_ligth = self.world.get_traffic_light(landmark)
+                    if traffic_ligth is not None:
+                        self._tls[landmark.id] = traffic_ligth
+                    else:
+                        logging.warning('Landmark %s is not linked to any traffic light', landmark.id)
+        return self._tls
+
+
+class CarlaSimulation(object):
+    """
+    CarlaSimulation is responsible for the management of the carla simulation.
+    """
+    def __init__(self, host, port, step_length, cfg, profiler=None, session=None):
+        # Without a session shared between junctions, the map is loaded for every junction.
+        self.session = session if session is not None else CarlaSession(host, port)
+        self.client = self.session.client
+
+        self.world = self.session.get_world(cfg.get('town', 'Town05'))
         self.spectator = self.world.get_spectator()
         spec_tf = self.spectator.get_transform()
         spec_tf.location.x = cfg['junc_coor'][0] - cfg['offset'][0]
@@ -70,39 +137,67 @@ class CarlaSimulation(object):
         self.blueprint_library = self.world.get_blueprint_library()
         self.step_length = step_length
         self.cfg = cfg
+        self.profiler = profiler if profiler is not None else TickProfiler()
 
         # The following sets contain updated information for the current frame.
         self.ego_vehicle_id = None
         self._active_actors = set()
         self.spawned_actors = set()
         self.destroyed_actors = set()
+        # Static attributes of the vehicles, read once per actor: {actor_id: (type_id, length, width,
+        # height)}. Ids of the other actors (sensors, traffic lights, ...) seen in the snapshots are
+        # kept to look them up only once as well.
+        self._vehicle_attributes = {}
+        self._other_actors = set()
+        # Light state last set by synchronize_vehicles: {actor_id: lights}. Vehicles spawned by the
+        # co-simulation start with all the lights off.
+        self._vehicle_lights = {}
         # the dict for attached sensors,
         # Format: {actor_id1: [sensor_id1, sensor_id2, ...], sensor_id2: [sensor_id1, sensor_id2, ...], ...}
         self.spawned_actors2sensors = {}
         self.all_sensors = []
-        # 4 Queues for camera, camera_sem, lidar, lidar_sem data respectively
-        n_sensors_per_vehicle = len(cfg["sensor_names"])
-        self.sensor_queues = [queue.Queue() for i in range(n_sensors_per_vehicle)]
-        # self.world_queue = queue.Queue()
+        # Sensor data of all vehicles, keyed by (frame, sensor_id). After each tick we wait up to
+        # sensor_timeout seconds for all listening sensors to deliver the frame.
+        self.sensor_buffer = SensorFrameBuffer(cfg.get('sensor_timeout', 1.0), self.profiler)
+        self.frame = None
+        # Sensor data is written by a bounded pool of background threads.
+        writer_cfg = cfg.get('writer', {})
+        self.writer = SensorWriterPool(writer_cfg.get('num_workers', 2),
+                                       writer_cfg.get('max_queue_depth', 32), self.profiler)
+        # Meta information is written either as one text file per frame ('txt') or to a single
+        # binary log per run ('log').
+        self.meta_log = None
+        if cfg.get('meta_format', 'txt') == 'log':
+            self.meta_log = MetaLog(os.path.join(cfg['root_path'], 'meta.bin'))
+        # Sensor data is stored either in the <vehicle_id>/<sensor>/<frame> tree ('tree') or as raw
+        # payloads appended to a few journal files per run ('journal').
+        self.journal = None
+        if cfg.get('storage', 'tree') == 'journal':
+            self.journal = SensorJournal(os.path.join(cfg['root_path'], 'journal'))
+        # Optionally, sensor frames are also published live to a shared-memory ring buffer.
+        self.publisher = None
+        publisher_cfg = cfg.get('publisher', {})
+        if publisher_cfg.get('enabled', False):
+            self.publisher = FramePublisher(publisher_cfg.get('name', 'cosense_frames'),
+                                            publisher_cfg.get('n_slots', 16),
+                                            publisher_cfg.get('slot_size', 4 << 20),
+                                            publisher_cfg.get('sensors', None))
         # self.world_snapshot = None
         # self.world.on_tick(self.world_queue.put) # on tick can only be used in asynchronous mode
 
-        self.fh = open(self.cfg['root_path'] + '/info.csv', mode='w')
-        self.file_writer = csv.writer(self.fh, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        self.file_writer.writerow(['frame', 'vehicle_id', 'x', 'y', 'z', 'roll', 'pitch', 'yaw',
-                                   'length', 'width', 'height'])
+        # Vehicle trajectories are written either to info.csv ('csv') or to the binary columnar
+        # file trajectory.bin ('bin', see scripts/python/export_trajectory.py).
+        self.fh = None
+        self.trajectory = None
+        if cfg.get('trajectory_format', 'csv') == 'bin':
+            self.trajectory = TrajectoryRecorder(os.path.join(cfg['root_path'], 'trajectory.bin'))
+        else:
+            self.fh = open(self.cfg['root_path'] + '/info.csv', mode='w')
+            self.file_writer = csv.writer(self.fh, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            self.file_writer.writerow(INFO_CSV_HEADER)
 
         # Set traffic lights.
-        self._tls = {}  # {landmark_id: traffic_light_actor}
-
-        tmp_map = self.world.get_map()
-        for landmark in tmp_map.get_all_landmarks_of_type('1000001'):
-            if landmark.id != '':
-                traffic_ligth = self.world.get_traffic_light(landmark)
-                if traffic_ligth is not None:
-                    self._tls[landmark.id] = traffic_ligth
-                else:
-                    logging.warning('Landmark %s is not linked to any traffic light', landmark.id)
+        self._tls = self.session.get_traffic_lights()  # {landmark_id: traffic_light_actor}
 
     def get_actor(self, actor_id):
         """
@@ -125,6 +220,12 @@ class CarlaSimulation(object):
         except RuntimeError:
             return None
 
+    def get_applied_light_state(self, actor_id):
+        """
+        Light state last set by synchronize_vehicles on the given vehicle, without querying carla.
+        """
+        return self._vehicle_lights.get(actor_id, int(carla.VehicleLightState.NONE))
+
     @property
     def traffic_light_ids(self):
         return set(self._tls.keys())
@@ -170,8 +271,30 @@ class CarlaSimulation(object):
             logging.error('Spawn carla actor failed. %s', response.error)
             return INVALID_ACTOR_ID
 
+        self._cache_actor(self.world.get_actor(response.actor_id))
         return response.actor_id
 
+    def _cache_actor(self, actor):
+        if actor is None:
+            return
+        if actor.type_id.startswith('vehicle.'):
+            extent = actor.bounding_box.extent
+            self._vehicle_attributes[actor.id] = (actor.type_id, extent.x * 2, extent.y * 2, extent.z * 2)
+        else:
+            self._other_actors.add(actor.id)
+
+    def _update_actor_cache(self, world_snapshot):
+        """
+        Reads the static attributes of the actors that appear in the snapshot for the first time,
+        with a single request.
+        """
+        unknown = [actor_snapshot.id for actor_snapshot in world_snapshot
+                   if actor_snapshot.id not in self._vehicle_attributes
+                   and actor_snapshot.id not in self._other_actors]
+        if unknown:
+            for actor in self.world.get_actors(unknown):
+                self._cache_actor(actor)
+
     def spawn_sensors_for(self, vehicle_id):
         sensor_names = self.cfg["sensor_names"]
         sensors_list = []
@@ -213,10 +336,11 @@ class CarlaSimulation(object):
                     logging.error(response.error)
                 else:
                     sensors_list.append(self.world.get_actor(response.actor_id))
+                    self._other_actors.add(response.actor_id)
             # Make folders for storing data of this vehicle
             data_path = os.path.join(self.cfg['root_path'], '%06d' % vehicle_id)
 
-            if not os.path.exists(data_path):
+            if self.journal is None and not os.path.exists(data_path):
                 for name in sensor_names:
                     os.makedirs(os.path.join(data_path, name))
             self.all_sensors.extend(sensors_list)
@@ -229,27 +353,43 @@ class CarlaSimulation(object):
             # same configuration for all callbacks passed to the sensors. Use functiontools to wrap the same callback
             # and fix some arguments with different parameters and force the same callback function to be different
             # callback functions.
-            # self.sensor_queues[vehicle_id] = [queue.Queue() for i in range(4)]
-            sensors_list[i].listen(functools.partial(carla_sensor_callback,
-                                                      sensor_queue=self.sensor_queues[i],
+            sensors_list[i].listen(functools.partial(self.sensor_buffer.put,
                                                       sensor_name=sensor_names[i],
                                                       sensor_id=sensors_list[i].id,
                                                       parent_id=vehicle_id))
+            self.sensor_buffer.activate(sensors_list[i].id, self._is_sensor_expected(sensor_names[i]))
+
+    def _is_sensor_expected(self, sensor_name):
+        # Sensors with a sensor_tick longer than the simulation step do not deliver every frame, they are not
+        # waited for and their late data is saved with the next frame.
+        sensor_cfg = self.cfg['cameras'][0] if 'camera' in sensor_name else self.cfg['lidars'][0]
+        return float(sensor_cfg.get('sensor_tick', 0.0)) <= self.step_length + 1e-6
 
     def destroy_sensors_for(self, vehicle_id):
-        for sensor in self.spawned_actors2sensors[vehicle_id]:
-            sensor.destroy() # This will trigger an error in streaming and mess up the data order
-        self.spawned_actors2sensors.pop(vehicle_id)
+        sensors = self.spawned_actors2sensors.pop(vehicle_id)
+        for sensor in sensors:
+            self.sensor_buffer.deactivate(sensor.id)
+            # Destroying a listening sensor will trigger an error in streaming and mess up the data order
+            if sensor.is_listening:
+                sensor.stop()
+            self.all_sensors.remove(sensor)
+        self.destroy_actors([sensor.id for sensor in sensors])
 
     def stop_sensors_for(self, vehicle_id):
         for sensor in self.spawned_actors2sensors[vehicle_id]:
+            self.sensor_buffer.deactivate(sensor.id)
             sensor.stop()
 
     def destroy_all_actors(self):
         for sensor in self.all_sensors:
-            sensor.destroy()
-        for vehicle_id in self._active_actors:
-            self.destroy_actor(vehicle_id)
+            self.sensor_buffer.deactivate(sensor.id)
+            if sensor.is_listening:
+                sensor.stop()
+        # Sensors first, then the vehicles they are attached to.
+        actor_ids = [sensor.id for sensor in self.all_sensors] + list(self._active_actors)
+        self.destroy_actors(actor_ids, verify=True)
+        self.all_sensors = []
+        self.spawned_actors2sensors = {}
 
         # self.spawned_actors2sensors = {}
 
@@ -264,9 +404,34 @@ class CarlaSimulation(object):
         """
         Destroys the given actor
         """
-        actor = self.world.get_actor(actor_id)
-        if actor is not None:
-            actor.destroy()
+        self.destroy_actors([actor_id])
+
+    def destroy_actors(self, actor_ids, verify=False):
+        """
+        Destroys the given actors with a single batch of commands.
+
+            :param actor_ids: ids of the actors to be destroyed.
+            :param verify: if True, checks afterwards which of the actors are still alive.
+            :return: set of ids of the actors left alive (empty if verify is False).
+        """
+        actor_ids = list(actor_ids)
+        if not actor_ids:
+            return set()
+        self._other_actors.difference_update(actor_ids)
+        for actor_id in actor_ids:
+            self._vehicle_lights.pop(actor_id, None)
+        batch = [carla.command.DestroyActor(actor_id) for actor_id in actor_ids]
+        for actor_id, response in zip(actor_ids, self.client.apply_batch_sync(batch, False)):
+            if response.has_error():
+                # Usually the actor is already gone, the verification pass reports real leftovers.
+                logging.debug('Actor %d not destroyed: %s', actor_id, response.error)
+
+        if not verify:
+            return set()
+        left = set(actor.id for actor in self.world.get_actors(actor_ids) if actor.is_alive)
+        if left:
+            logging.warning('%d actors left alive after destroying them: %s', len(left), sorted(left))
+        return left
 
     def synchronize_vehicle(self, vehicle_id, transform, lights=None):
         """
@@ -286,18 +451,66 @@ class CarlaSimulation(object):
             vehicle.set_light_state(carla.VehicleLightState(lights))
         return True
 
+    def synchronize_vehicles(self, updates):
+        """
+        Updates the state of several vehicles with a single batch of commands.
+
+            :param updates: list of (vehicle_id, transform, lights), lights may be None. The light
+                            state is only sent when it differs from the last one sent.
+            :return: set of ids of the vehicles that could not be updated.
+        """
+        batch = []
+        vehicle_ids = []
+        for vehicle_id, transform, lights in updates:
+            batch.append(carla.command.ApplyTransform(vehicle_id, transform))
+            vehicle_ids.append(vehicle_id)
+            if lights is not None and lights != self.get_applied_light_state(vehicle_id):
+                batch.append(carla.command.SetVehicleLightState(vehicle_id, carla.VehicleLightState(lights)))
+                vehicle_ids.append(vehicle_id)
+                self._vehicle_lights[vehicle_id] = lights
+
+        failed = set()
+        if not batch:
+            return failed
+        # apply_batch_sync returns one response per command, apply_batch would drop the errors.
+        for vehicle_id, response in zip(vehicle_ids, self.client.apply_batch_sync(batch, False)):
+            if response.has_error():
+                logging.warning('Vehicle %d not synchronized: %s', vehicle_id, response.error)
+                failed.add(vehicle_id)
+                self._vehicle_lights.pop(vehicle_id, None)
+        return failed
+
     def synchronize_sensors(self):
-        for k, v in self.spawned_actors2sensors.items():
-            for j in range(len(v)):
-                if not self.sensor_queues[j].empty():
-                    sensor_name, sensor_id, vehicle_id, data = self.sensor_queues[j].get(True, timeout=60.0)
-                    if self.world.get_actor(sensor_id) is not None and self.world.get_actor(vehicle_id) is not None:
-                        ext = 'png' if 'camera' in sensor_name else 'pcd'
-                        callback = _get_data_callback(sensor_name)
-                        callback(data, file_name=self.cfg['root_path'] + '/%06d/' % vehicle_id
-                                                 + sensor_name + '/%06d.' % data.frame + ext)
-                    else:
-                        raise ValueError("synchronize_sensors: sensor or vehicle not found.")
+        with self.profiler.phase('sensor_wait'):
+            sensor_data = self.sensor_buffer.retrieve(self.frame)
+        with self.profiler.phase('sensor_save'):
+            self._save_sensor_data(sensor_data)
+        logging.debug('Sensor writer queue depth: %d, sensor frames: %s', self.writer.queue_depth,
+                      self.sensor_buffer.get_stats())
+
+    def _save_sensor_data(self, sensor_data):
+        for sensor_name, sensor_id, vehicle_id, data in sensor_data:
+            if self.world.get_actor(sensor_id) is not None and self.world.get_actor(vehicle_id) is not None:
+                if self.publisher is not None:
+                    self.publisher.publish(sensor_name, sensor_id, vehicle_id, data)
+                if self.journal is not None:
+                    self.writer.submit(sensor_name, self.journal.append, sensor_name, sensor_id,
+                                       vehicle_id, data)
+                    continue
+                ext = _get_file_extension(sensor_name, self.cfg)
+                callback = _get_data_callback(sensor_name, self.cfg)
+                meta_writer = None
+                if self.meta_log is not None:
+                    meta_writer = self.meta_log.writer_for(sensor_name, sensor_id, vehicle_id)
+                self.writer.submit(sensor_name, callback, data,
+                                   file_name=self.cfg['root_path'] + '/%06d/' % vehicle_id
+                                             + sensor_name + '/%06d.' % data.frame + ext,
+                                   meta_writer=meta_writer)
+            else:
+                # Data carried from an earlier frame may outlive its sensor or vehicle.
+                logging.debug('Sensor %d or vehicle %d not found, frame %d of %s dropped.', sensor_id,
+                              vehicle_id, data.frame, sensor_name)
+                self.sensor_buffer.drop()
 
     def synchronize_traffic_light(self, landmark_id, state):
         """
@@ -319,27 +532,37 @@ class CarlaSimulation(object):
         """
         Tick to carla simulation.
         """
-        self.world.tick()
+        with self.profiler.phase('world_tick'):
+            self.frame = self.world.tick()
         # self.world_snapshot = self.world_queue.get(timeout=60.0)
         # Update data structures for the current frame.
-        current_actors = set(
-            [vehicle.id for vehicle in self.world.get_actors().filter('vehicle.*')])
-        self.spawned_actors = current_actors.difference(self._active_actors)
-        self.destroyed_actors = self._active_actors.difference(current_actors)
-        self._active_actors = current_actors
-
-        world_snapshot = self.world.get_snapshot()
-        for v in current_actors:
-            line = '{:06},{},{:d}' + ',{:.3f}' * 9
-            tf = world_snapshot.find(v).get_transform()
-            vehicle = self.world.get_actor(v)
-            extent = vehicle.bounding_box.extent
-            type_id = vehicle.type_id
-            line = line.format(world_snapshot.frame, type_id, v,
-                        tf.location.x, tf.location.y, tf.location.z,
-                        tf.rotation.roll, tf.rotation.pitch, tf.rotation.yaw,
-                        extent.x * 2, extent.y * 2, extent.z * 2)
-            self.file_writer.writerow(line.split(','))
+        # Actors and poses come from the snapshot of the tick, the static attributes from the cache.
+        with self.profiler.phase('update_actors'):
+            world_snapshot = self.world.get_snapshot()
+            self._update_actor_cache(world_snapshot)
+            vehicle_snapshots = [actor_snapshot for actor_snapshot in world_snapshot
+                                 if actor_snapshot.id in self._vehicle_attributes]
+            current_actors = set(actor_snapshot.id for actor_snapshot in vehicle_snapshots)
+            self.spawned_actors = current_actors.difference(self._active_actors)
+            self.destroyed_actors = self._active_actors.difference(current_actors)
+            self._active_actors = current_actors
+            for actor_id in self.destroyed_actors:
+                self._vehicle_attributes.pop(actor_id, None)
+
+        with self.profiler.phase('info_csv'):
+            for actor_snapshot in vehicle_snapshots:
+                tf = actor_snapshot.get_transform()
+                type_id, length, width, height = self._vehicle_attributes[actor_snapshot.id]
+                location = (tf.location.x, tf.location.y, tf.location.z)
+                rotation = (tf.rotation.roll, tf.rotation.pitch, tf.rotation.yaw)
+                if self.trajectory is not None:
+                    self.trajectory.append(world_snapshot.frame, actor_snapshot.id, type_id, location,
+                                           rotation, (length, width, height))
+                else:
+                    self.file_writer.writerow(format_info_row(world_snapshot.frame, type_id, actor_snapshot.id,
+                                                              location + rotation + (length, width, height)))
+            if self.trajectory is not None:
+                self.trajectory.end_tick()
 
         self.synchronize_sensors()
 
@@ -347,7 +570,21 @@ class CarlaSimulation(object):
         """
         Closes carla client.
         """
-        self.fh.close()
+        self.writer.close()
+        self.writer.log_stats()
+        logging.info('Sensor frames: %s', self.sensor_buffer.get_stats())
+        if self.meta_log is not None:
+            self.meta_log.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.publisher is not None:
+            if self.publisher.n_dropped > 0:
+                logging.warning('Publisher dropped %d oversized frames.', self.publisher.n_dropped)
+            self.publisher.close()
+        if self.trajectory is not None:
+            self.trajectory.close()
+        if self.fh is not None:
+            self.fh.close()
         self.destroy_all_actors()
         # for actor in self.world.get_actors():
         #     if actor.type_id == 'traffic.traffic_light':
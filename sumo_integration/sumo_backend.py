@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+""" This module selects the python binding used to drive sumo: traci or libsumo. """
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import logging
+
+import traci as _traci  # pylint: disable=import-error
+
+# ==================================================================================================
+# -- sumo backend ----------------------------------------------------------------------------------
+# ==================================================================================================
+
+BACKENDS = ('auto', 'traci', 'libsumo')
+
+
+class SumoBackend(object):
+    """
+    SumoBackend forwards the traci API (vehicle, simulation, trafficlight, ...) to the selected
+    binding. traci talks to a sumo process through a socket, libsumo runs sumo in the same process
+    with the same API and no inter-process round trips, but without gui nor remote connection.
+    """
+    def __init__(self):
+        self._module = _traci
+        self.backend = 'traci'
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def use(self, backend):
+        if backend == 'libsumo':
+            import libsumo  # pylint: disable=import-error
+            self._module = libsumo
+        else:
+            self._module = _traci
+        self.backend = backend
+
+    def start(self, cmd, port=None):
+        """
+        Starts a new sumo simulation. The port is only used by traci.
+        """
+        if self.backend == 'libsumo':
+            return self._module.start(cmd)
+        return self._module.start(cmd, port=port)
+
+    def set_order(self, client_order):
+        """
+        Sets the client order of the traci connection. libsumo has a single client.
+        """
+        if self.backend == 'traci':
+            self._module.setOrder(client_order)
+
+
+# All the sumo calls of the co-simulation go through this object.
+traci = SumoBackend()
+
+
+def select_backend(backend='auto', sumo_gui=False, host=None, port=None):
+    """
+    Selects the binding used by traci. 'auto' picks libsumo when sumo runs headless in this
+    process (no gui, host or port requested) and libsumo is installed, traci otherwise.
+
+        :return: name of the selected binding.
+    """
+    if backend not in BACKENDS:
+        raise ValueError('unknown sumo backend %s, expected one of %s' % (backend, BACKENDS))
+
+    if backend == 'libsumo' and (sumo_gui or host is not None):
+        raise ValueError('libsumo can neither run sumo-gui nor connect to a sumo server')
+
+    if backend == 'auto':
+        backend = 'traci'
+        if not sumo_gui and host is None and port is None:
+            try:
+                import libsumo  # pylint: disable=import-error,unused-import
+                backend = 'libsumo'
+            except ImportError:
+                logging.info('libsumo not found, using traci.')
+
+    traci.use(backend)
+    logging.info('Using %s to drive sumo.', backend)
+    return backend
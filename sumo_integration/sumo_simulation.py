@@ -15,14 +15,15 @@ import collections
 import enum
 import logging
 import os
-import numpy as np
 
 import carla  # pylint: disable=import-error
 import sumolib  # pylint: disable=import-error
-import traci  # pylint: disable=import-error
-import traci.constants as tc
+import traci.constants as tc  # pylint: disable=import-error
 
+from .actor_registry import EGO, IN_RANGE, PERCEPTION, ActorRegistry
 from .constants import INVALID_ACTOR_ID
+from .sumo_backend import select_backend, traci
+from util.sampling import HysteresisSampler, sample_actors
 
 import lxml.etree as ET  # pylint: disable=import-error
 
@@ -103,6 +104,14 @@ class SumoActorClass(enum.Enum):
 
 SumoActor = collections.namedtuple('SumoActor', 'type_id vclass transform signals extent color')
 
+# RGBA colors of the vehicles in sumo-gui, by role in the scene of the ego vehicle.
+ROLE_COLORS = {
+    'ego': (255, 0, 0, 255),
+    'inrange': (0, 255, 0, 255),
+    'perception': (255, 0, 255, 255),
+    'plain': (255, 255, 0, 255),
+}
+
 # ==================================================================================================
 # -- sumo traffic lights ---------------------------------------------------------------------------
 # ==================================================================================================
@@ -303,7 +312,7 @@ def _get_sumo_net(cfg_file):
     net_file = os.path.join(os.path.dirname(cfg_file), tag.get('value'))
     logging.debug('Reading net file: %s', net_file)
 
-    sumo_net = traci.sumolib.net.readNet(net_file)
+    sumo_net = sumolib.net.readNet(net_file)
     return sumo_net
 
 
@@ -319,29 +328,37 @@ class SumoSimulation(object):
                  sumo_gui=False,
                  client_order=1,
                  ego_vehicle_id='0',
-                 comm_range=50.0):
+                 comm_range=50.0,
+                 n_samples=5,
+                 node_selection=None,
+                 backend='auto'):
         if sumo_gui is True:
             sumo_binary = sumolib.checkBinary('sumo-gui')
         else:
             sumo_binary = sumolib.checkBinary('sumo')
 
+        # libsumo runs sumo in this process, it is picked for headless runs if installed.
+        self.backend = select_backend(backend, sumo_gui, host, port)
+
         if host is None or port is None:
             logging.info('Starting new sumo server...')
             if sumo_gui is True:
                 logging.info('Remember to press the play button to start the simulation')
 
+            # The server listens on the given port, or on a free one if port is None. With libsumo
+            # sumo runs in this process.
             traci.start([sumo_binary,
                 '--configuration-file', cfg_file,
                 '--step-length', str(step_length),
                 '--lateral-resolution', '0.25',
                 '--collision.check-junctions'
-            ])
+            ], port=port)
 
         else:
             logging.info('Connection to sumo server. Host: %s Port: %s', host, port)
             traci.init(host=host, port=port)
 
-        traci.setOrder(client_order)
+        traci.set_order(client_order)
 
         # Retrieving net from configuration file.
         self.net = _get_sumo_net(cfg_file)
@@ -357,6 +374,14 @@ class SumoSimulation(object):
         self.ego_vehicle = ego_vehicle_id
         self.ego_vehicle_state = 0  # 0: not departed yet, 1: departed, 2: arrived
         self.comm_range = comm_range
+        # Number of vehicles of the collective perception network, including the ego vehicle.
+        self.n_samples = n_samples
+        # Perception node selection: 'fps' picks the nodes from scratch every tick, 'hysteresis'
+        # keeps them for some ticks to avoid spawning and stopping sensors on small moves.
+        node_selection = node_selection if node_selection is not None else {}
+        self.node_selection = node_selection.get('mode', 'fps')
+        self.node_sampler = HysteresisSampler(n_samples, node_selection.get('min_ticks', 10),
+                                              node_selection.get('margin', 0.2))
 
         # Structures to keep track of the spawned, destroyed vehicles and the vehicles that are in the range of
         # ego vehicle at each time step.
@@ -367,6 +392,14 @@ class SumoSimulation(object):
         self.sensor_to_stop = set()  # actors on which the attached sensors should be destroyed
         self.perception_actors = set()
 
+        # State of the subscribed actors, updated from the subscription results at each tick.
+        self.registry = ActorRegistry()
+
+        # Vehicles are colored by role only for sumo-gui, the last color of each vehicle is kept to
+        # send only the changes.
+        self.color_vehicles = sumo_gui
+        self.vehicle_roles = {}
+
         # Traffic light manager.
         self.traffic_light_manager = SumoTLManager()
 
@@ -377,10 +410,9 @@ class SumoSimulation(object):
     def traffic_light_ids(self):
         return self.traffic_light_manager.get_all_landmarks()
 
-    @staticmethod
-    def subscribe(actor_id):
+    def subscribe(self, actor_id):
         """
-        Subscribe the given actor to the following variables:
+        Subscribe the given actor to the following variables, and register it:
 
             * Type.
             * Vehicle class.
@@ -398,13 +430,21 @@ class SumoSimulation(object):
             tc.VAR_POSITION3D, tc.VAR_ANGLE, tc.VAR_SLOPE,
             tc.VAR_SPEED, tc.VAR_SIGNALS
         ])
+        # Vehicles departed in this tick are registered after the roles were flagged.
+        flags = EGO if actor_id == self.ego_vehicle else 0
+        if actor_id in self.inrange_actors:
+            flags |= IN_RANGE
+        if actor_id in self.perception_actors:
+            flags |= PERCEPTION
+        self.registry.add(actor_id, flags=flags)
+        self.registry.update({actor_id: traci.vehicle.getSubscriptionResults(actor_id)}, static=True)
 
-    @staticmethod
-    def unsubscribe(actor_id):
+    def unsubscribe(self, actor_id):
         """
         Unsubscribe the given actor from receiving updated information each step.
         """
         traci.vehicle.unsubscribe(actor_id)
+        self.registry.remove(actor_id)
 
     def subscribe_context(self, actor_id=None):
         """
@@ -441,30 +481,20 @@ class SumoSimulation(object):
             return (0, 0)
         return self.net.getLocationOffset()
 
-    @staticmethod
-    def get_actor(actor_id):
+    def get_actor(self, actor_id):
         """
-        Accessor for sumo actor.
+        Accessor for sumo actor, read from the registry.
         """
-        results = traci.vehicle.getSubscriptionResults(actor_id)
-
-        type_id = results[tc.VAR_TYPE]
-        vclass = SumoActorClass(results[tc.VAR_VEHICLECLASS])
-        color = results[tc.VAR_COLOR]
-
-        length = results[tc.VAR_LENGTH]
-        width = results[tc.VAR_WIDTH]
-        height = results[tc.VAR_HEIGHT]
+        registry = self.registry
+        row = registry.row(actor_id)
 
-        location = list(results[tc.VAR_POSITION3D])
-        rotation = [results[tc.VAR_SLOPE], results[tc.VAR_ANGLE], 0.0]
-        transform = carla.Transform(carla.Location(location[0], location[1], location[2]),
-                                    carla.Rotation(rotation[0], rotation[1], rotation[2]))
+        location = registry.location[row]
+        rotation = registry.rotation[row]
+        transform = carla.Transform(carla.Location(*location.tolist()), carla.Rotation(*rotation.tolist()))
+        extent = carla.Vector3D(*registry.extent[row].tolist())
 
-        signals = results[tc.VAR_SIGNALS]
-        extent = carla.Vector3D(length / 2.0, width / 2.0, height / 2.0)
-
-        return SumoActor(type_id, vclass, transform, signals, extent, color)
+        return SumoActor(registry.type_ids[row], SumoActorClass(registry.vclasses[row]), transform,
+                         int(registry.signals[row]), extent, tuple(registry.color[row].tolist()))
 
     def get_in_range_actors(self):
         results = traci.vehicle.getContextSubscriptionResults(self.ego_vehicle)
@@ -495,7 +525,7 @@ class SumoSimulation(object):
             
         try:
             traci.vehicle.add(actor_id, 'carla_route', typeID=type_id)
-        except traci.exceptions.TraCIException as error:
+        except traci.TraCIException as error:
             logging.error('Spawn sumo actor failed: %s', error)
             return INVALID_ACTOR_ID
 
@@ -505,12 +535,12 @@ class SumoSimulation(object):
 
         return actor_id
 
-    @staticmethod
-    def destroy_actor(actor_id):
+    def destroy_actor(self, actor_id):
         """
         Destroys the given actor.
         """
         traci.vehicle.remove(actor_id)
+        self.registry.remove(actor_id)
 
     def get_traffic_light_state(self, landmark_id):
         """
@@ -553,62 +583,71 @@ class SumoSimulation(object):
         """
         self.traffic_light_manager.set_state(landmark_id, state)
 
+    def get_vehicle_role(self, vehicle):
+        """
+        Role of the vehicle in the scene of the ego vehicle, read from its registry flags. Vehicles
+        not registered yet (e.g. departed in this tick) are looked up in the role sets.
+        """
+        if vehicle in self.registry:
+            in_range = self.registry.has_flag(vehicle, IN_RANGE)
+            is_ego = self.registry.has_flag(vehicle, EGO)
+            is_perception = self.registry.has_flag(vehicle, PERCEPTION)
+        else:
+            in_range = vehicle in self.inrange_actors
+            is_ego = vehicle == self.ego_vehicle
+            is_perception = vehicle in self.perception_actors
+
+        if not in_range:
+            return 'plain'
+        if is_ego:
+            return 'ego'
+        if is_perception:
+            return 'perception'
+        return 'inrange'
+
     def adjust_vehicle_colors(self):
-        """Adjust the colors of the vehicles only when the ego vehicle is alive.
-           Red   : ego vehicle
-           Green : neighbors in the range of ego vehicle
-           Blue  : vehicle in the collective perception network
-           Yellow: plain participants
+        """Adjust the colors of the vehicles only when the ego vehicle is alive. Only the vehicles
+           whose role changed since the last call are colored, and only in sumo-gui.
+           Red    : ego vehicle
+           Green  : neighbors in the range of ego vehicle
+           Magenta: vehicle in the collective perception network
+           Yellow : plain participants
            Color format: RGBA
         """
-        if self.ego_vehicle_state==1:
-            for vehicle in traci.vehicle.getIDList():
-                if vehicle in self.inrange_actors:
-                    if vehicle == self.ego_vehicle:
-                        traci.vehicle.setColor(vehicle, (255, 0, 0, 255))
-                    elif vehicle in self.perception_actors:
-                        traci.vehicle.setColor(vehicle, (255, 0, 255, 255))
-                    else:
-                        traci.vehicle.setColor(vehicle, (0, 255, 0, 255))
-                else:
-                    traci.vehicle.setColor(vehicle, (255, 255, 0, 255))
-
-    def update_perception_nodes_geo(self, locations, n_samples=5):
-        choosen = [self.ego_vehicle]
-        not_choosen = list(locations.copy().keys())
-        not_choosen.remove(self.ego_vehicle)
-        for _ in range(n_samples):
-            max_dist = 0
-            max_idx = -1
-            for i, k in enumerate(not_choosen):
-                min_dist = min([np.linalg.norm(np.array(locations[actor]) - np.array(locations[k])) for actor in choosen])
-                if max_dist < min_dist:
-                    max_dist =  min_dist
-                    max_idx = not_choosen[i]
-            if max_idx!=-1:
-                choosen.append(max_idx)
-                not_choosen.remove(max_idx)
-        # choosen.remove(self.ego_vehicle)
-        self.perception_actors = set(choosen)
-
-    def update_perception_nodes_fps(self, locations, n_samples=5):
-        if len(locations) <= 5:
-            self.perception_actors = set(list(locations.copy().keys()))
+        if not self.color_vehicles or self.ego_vehicle_state != 1:
             return
-        solution_set = [self.ego_vehicle]
-        remaining_points = list(locations.copy().keys())
-        remaining_points.remove(self.ego_vehicle)
+        vehicle_roles = {}
+        for vehicle in traci.vehicle.getIDList():
+            role = self.get_vehicle_role(vehicle)
+            if self.vehicle_roles.get(vehicle) != role:
+                traci.vehicle.setColor(vehicle, ROLE_COLORS[role])
+            vehicle_roles[vehicle] = role
+        self.vehicle_roles = vehicle_roles
+
+    def update_perception_nodes_geo(self, locations, n_samples=None):
+        """
+        Picks the ego vehicle and n_samples more vehicles by farthest point sampling. Vehicles at the
+        location of a picked vehicle are never picked.
+        """
+        n_samples = self.n_samples if n_samples is None else n_samples
+        self.perception_actors = sample_actors(locations, self.ego_vehicle, n_samples + 1, distinct=True)
 
-        def distance(a, b):
-            return np.linalg.norm(np.array(a) - np.array(b))
+    def update_perception_nodes_fps(self, locations, n_samples=None):
+        """
+        Picks n_samples vehicles, starting with the ego vehicle, by farthest point sampling.
+        """
+        n_samples = self.n_samples if n_samples is None else n_samples
+        if len(locations) <= n_samples:
+            self.perception_actors = set(locations.keys())
+            return
+        self.perception_actors = sample_actors(locations, self.ego_vehicle, n_samples)
 
-        for _ in range(n_samples - 1):
-            distances = [distance(locations[p], locations[solution_set[0]]) for p in remaining_points]
-            for i, p in enumerate(remaining_points):
-                for j, s in enumerate(solution_set):
-                    distances[i] = min(distances[i], distance(locations[p], locations[s]))
-            solution_set.append(remaining_points.pop(distances.index(max(distances))))
-        self.perception_actors = set(solution_set)
+    def update_perception_nodes_hysteresis(self, locations):
+        """
+        Picks n_samples vehicles, starting with the ego vehicle, keeping the vehicles picked in the
+        previous ticks (see HysteresisSampler).
+        """
+        self.perception_actors = self.node_sampler.select(locations, self.ego_vehicle, self.ticks)
 
     def tick(self):
         """
@@ -616,6 +655,8 @@ class SumoSimulation(object):
         """
         traci.simulationStep()
         self.traffic_light_manager.tick()
+        # The results of all the subscribed actors are fetched at once.
+        self.registry.update(traci.vehicle.getAllSubscriptionResults())
 
         # Update data structures for the current frame.
         self.spawned_actors = set(traci.simulation.getDepartedIDList())
@@ -629,14 +670,20 @@ class SumoSimulation(object):
         # if ego vehicle is alive, otherwise terminate the simulation:
         #   Red: ego vehicle,
         #   Green: neighbor in range of ego vehicle,
-        #   Blue: neighbors which participate in the collective perception
+        #   Magenta: neighbors which participate in the collective perception
         #   Yellow: normal participants
         if self.ego_vehicle_state==1:
             self.ticks += 1
             perception_nodes_last_step = self.perception_actors.copy()
             locations = self.get_in_range_actors()
             # Sample actors/node from in-range actors for collective perception
-            self.update_perception_nodes_fps(locations)
+            if self.node_selection == 'hysteresis':
+                self.update_perception_nodes_hysteresis(locations)
+            else:
+                self.update_perception_nodes_fps(locations)
+            self.registry.set_flag(EGO, [self.ego_vehicle])
+            self.registry.set_flag(IN_RANGE, self.inrange_actors)
+            self.registry.set_flag(PERCEPTION, self.perception_actors)
             # Update vehicle colors according to their role in the scene
             self.adjust_vehicle_colors()
             self.sensor_to_spawn = self.perception_actors.difference(perception_nodes_last_step)
@@ -0,0 +1,442 @@
+""" Parallel simulation of several junctions on a pool of carla/sumo instance pairs. """
+
+import contextlib
+import copy
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import signal
+import time
+
+import numpy as np
+
+from util.sumo_cfg import junction_sumocfg, write_sumocfg
+
+LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+# The manifest, logs and unfinished junctions of a campaign are kept in <root_path>/.campaign, so
+# the data root only holds the finished j<id> junction directories.
+CAMPAIGN_DIR = '.campaign'
+_JUNCTION_DIR = re.compile(r'^j\d+$')
+
+
+def campaign_path(root_path, *names):
+    return os.path.join(root_path, CAMPAIGN_DIR, *names)
+
+
+def junction_dirs(root_path):
+    """
+    Names of the finished junction directories (j<id>) of a data root, sorted.
+    """
+    return sorted(name for name in os.listdir(root_path)
+                  if _JUNCTION_DIR.match(name) and os.path.isdir(os.path.join(root_path, name)))
+
+
+def add_simulation_args(argparser):
+    """
+    Adds the co-simulation arguments shared by main.py and campaign.py. The carla and sumo ports
+    are added by each entry point.
+    """
+    argparser.add_argument('--sensor-cfg-file',
+                           metavar='C',
+                           default='config.json',
+                           help='Path for config files')
+    argparser.add_argument('--carla-host',
+                           metavar='H',
+                           default='127.0.0.1',
+                           help='IP of the carla host server (default: 127.0.0.1)')
+    argparser.add_argument('--sumo-gui', action='store_true', help='run the gui version of sumo')
+    argparser.add_argument('--sumo-backend',
+                           choices=['auto', 'traci', 'libsumo'],
+                           default='auto',
+                           help='python binding driving sumo, auto picks libsumo for headless runs without '
+                                'a sumo host or port if it is installed, traci otherwise. In a campaign, '
+                                'libsumo runs sumo inside the worker and ignores the port of the slot '
+                                '(default: auto)')
+    argparser.add_argument('--step-length',
+                           default=0.1,
+                           type=float,
+                           help='set fixed delta seconds (default: 0.1s)')
+    argparser.add_argument('--realtime-factor',
+                           default=1.0,
+                           type=float,
+                           help='pace the simulation to N times real time, 0 runs as fast as possible (default: 1.0)')
+    argparser.add_argument('--client-order',
+                           metavar='TRACI_CLIENT_ORDER',
+                           default=1,
+                           type=int,
+                           help='client order number for the co-simulation TraCI connection (default: 1)')
+    argparser.add_argument('--sync-vehicle-lights',
+                           action='store_true',
+                           help='synchronize vehicle lights state (default: False)')
+    argparser.add_argument('--sync-vehicle-color',
+                           action='store_true',
+                           help='synchronize vehicle color (default: False)')
+    argparser.add_argument('--sync-vehicle-all',
+                           action='store_true',
+                           help='synchronize all vehicle properties (default: False)')
+    argparser.add_argument('--tls-manager',
+                           type=str,
+                           choices=['none', 'sumo', 'carla'],
+                           help="select traffic light manager (default: none)",
+                           default='none')
+    argparser.add_argument('--pipelined',
+                           action='store_true',
+                           help='run the next sumo step while carla ticks and sensor data is saved; falls back to '
+                                'serial stepping when carla driven actors exist or with --tls-manager carla')
+    argparser.add_argument('--profile',
+                           action='store_true',
+                           help='time the phases of each tick and write profile.json next to info.csv')
+    argparser.add_argument('--profile-trace',
+                           action='store_true',
+                           help='also write a Chrome trace of all the threads to profile_trace.json')
+    argparser.add_argument('--debug', action='store_true', help='enable debug messages')
+
+
+class CampaignManifest(object):
+    """
+    CampaignManifest records the status (pending, running, done or failed), duration and output
+    size of every junction of a campaign in a JSON file, rewritten atomically on every change. A
+    restarted campaign simulates only the junctions that are not done.
+
+    Junctions are simulated into a partial directory, which is moved to <data_path> once the
+    simulation finished (see finish_output), so a done junction always has complete data.
+    """
+    def __init__(self, file_name, junctions):
+        self.file_name = file_name
+        self.junctions = {}
+        if os.path.exists(file_name):
+            with open(file_name) as f:
+                self.junctions = json.load(f)['junctions']
+        for junc_id in junctions:
+            if junc_id not in self.junctions:
+                self.junctions[junc_id] = {'status': PENDING}
+        self._save()
+
+    def _save(self):
+        tmp_file = self.file_name + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'junctions': self.junctions}, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.file_name)
+
+    def unfinished(self, junctions, root_path):
+        """
+        Returns the ids of the given junctions that still have to be simulated.
+        """
+        return [junc_id for junc_id in junctions
+                if self.junctions[junc_id]['status'] != DONE
+                or not os.path.isdir(os.path.join(root_path, 'j' + junc_id))]
+
+    def mark_running(self, junc_id, slot=None):
+        self.junctions[junc_id] = {'status': RUNNING, 'started': time.time(), 'slot': slot}
+        self._save()
+
+    def mark_done(self, junc_id, duration, size):
+        self.junctions[junc_id].update({'status': DONE, 'duration': duration, 'size_bytes': size})
+        self._save()
+
+    def mark_failed(self, junc_id, duration, error):
+        self.junctions[junc_id].update({'status': FAILED, 'duration': duration, 'error': error})
+        self._save()
+
+    def count(self):
+        """
+        Returns the number of junctions per status.
+        """
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for info in self.junctions.values():
+            counts[info['status']] += 1
+        return counts
+
+
+def partial_path(data_path):
+    """
+    Directory a junction is simulated into: <root_path>/.campaign/<junction_dir>.partial.
+    """
+    root_path, name = os.path.split(os.path.normpath(data_path))
+    return campaign_path(root_path, name + '.partial')
+
+
+def directory_size(path):
+    """
+    Total size in bytes of the files under path.
+    """
+    size = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(dir_path, file_name))
+    return size
+
+
+def start_output(data_path):
+    """
+    Creates an empty partial directory for the simulation of a junction, see partial_path.
+    """
+    partial = partial_path(data_path)
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    return partial
+
+
+def finish_output(data_path):
+    """
+    Moves the finished partial directory to data_path, replacing older data.
+        :returns: size of the data in bytes.
+    """
+    shutil.rmtree(data_path, ignore_errors=True)
+    os.replace(partial_path(data_path), data_path)
+    return directory_size(data_path)
+
+
+def parse_slots(text):
+    """
+    Parses a comma separated list of carla_port:sumo_port pairs, e.g. "2000:8813,3000:8823".
+        :returns list: [(carla_port, sumo_port), ...]
+    """
+    slots = []
+    for item in text.split(','):
+        carla_port, sumo_port = item.split(':')
+        slots.append((int(carla_port), int(sumo_port)))
+    return slots
+
+
+def prepare_junction(sensor_cfg, junc_id, junc_coor, data_path):
+    """
+    Returns the sensor config of a junction and writes its sumo config into data_path.
+    """
+    cfg = copy.deepcopy(sensor_cfg)
+    cfg['root_path'] = data_path
+    cfg['junc_coor'] = junc_coor
+    cfg['sumocfg'] = junction_sumocfg(data_path)
+    write_sumocfg(cfg['sumocfg'], junc_id, os.path.dirname(os.path.abspath(sensor_cfg['sumocfg'])))
+    return cfg
+
+
+def create_carla_session(args):
+    """
+    Connects to the carla server of a worker, the loaded map is kept for all its junctions.
+    """
+    from sumo_integration.carla_simulation import CarlaSession  # needs the carla module
+
+    return CarlaSession(args.carla_host, args.carla_port)
+
+
+def run_junction(args, cfg, carla_session=None):
+    """
+    Simulates a junction with carla and sumo.
+    """
+    from run_synchronization import synchronization_loop  # needs the carla and traci modules
+
+    return synchronization_loop(args, cfg, carla_session)
+
+
+def run_stand_in_junction(args, cfg, carla_session=None):
+    """
+    Stand-in for run_junction without carla and sumo, writing a few frames of fake data. Used to
+    try the campaign runner (queue, slots, logs, outputs) on a machine without the simulators.
+    """
+    logging.info('Stand-in simulation of %s on carla port %d, sumo port %d.',
+                 cfg['root_path'], args.carla_port, args.sumo_port)
+    rng = np.random.RandomState(args.carla_port)
+    n_frames = 10
+    with open(os.path.join(cfg['root_path'], 'info.csv'), 'w') as fh:
+        file_writer = csv.writer(fh, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        file_writer.writerow(['frame', 'vehicle_id', 'x', 'y', 'z', 'roll', 'pitch', 'yaw',
+                              'length', 'width', 'height'])
+        for frame in range(n_frames):
+            x, y = cfg['junc_coor']
+            file_writer.writerow(['%06d' % frame, 'vehicle.stand_in', 1, '%.3f' % x, '%.3f' % y, '0.000',
+                                  '0.000', '0.000', '0.000', '4.000', '2.000', '1.500'])
+            time.sleep(args.step_length)
+    lidar_path = os.path.join(cfg['root_path'], '%06d' % 1, 'lidar')
+    os.makedirs(lidar_path)
+    for frame in range(n_frames):
+        points = rng.uniform(-50.0, 50.0, size=(1000, 4)).astype(np.float32)
+        points.tofile(os.path.join(lidar_path, '%06d.bin' % frame))
+    return True
+
+
+@contextlib.contextmanager
+def _junction_log(log_file):
+    """
+    Sends logging and print output of the worker to the log file of a junction.
+    """
+    root_logger = logging.getLogger()
+    with open(log_file, 'a') as f, contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+        handler = logging.StreamHandler(f)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        old_handlers = root_logger.handlers[:]
+        root_logger.handlers = [handler]
+        try:
+            yield
+        finally:
+            root_logger.handlers = old_handlers
+
+
+def _cancel_junction(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _worker(slot, args, sensor_cfg, log_path, jobs, results, stand_in, stop):
+    # The worker and the sumo servers it starts get their own process group, so the campaign
+    # process can kill them all at once (see _stop_workers). Ctrl-C is handled by the campaign
+    # process, which sets stop and sends SIGTERM: the running junction is cancelled like with
+    # Ctrl-C in main.py, which closes sumo and carla, is not reported as done, and the worker exits.
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _cancel_junction)
+    logging.getLogger().setLevel(logging.DEBUG if args.debug else logging.INFO)
+    carla_port, sumo_port = slot
+    job_args = copy.copy(args)
+    job_args.carla_port = carla_port
+    # Every junction starts its own sumo server on the port of the slot.
+    job_args.sumo_host = None
+    job_args.sumo_port = sumo_port
+    runner = run_stand_in_junction if stand_in else run_junction
+    carla_session = None
+
+    try:
+        while not stop.is_set():
+            job = jobs.get()
+            if job is None:
+                return
+            junc_id, junc_coor, data_path = job
+            results.put({'junction': junc_id, 'status': RUNNING, 'slot': slot})
+            start = time.time()
+            status, error, size, cancelled = FAILED, None, 0, False
+            with _junction_log(os.path.join(log_path, 'j%s.log' % junc_id)):
+                try:
+                    cfg = prepare_junction(sensor_cfg, junc_id, junc_coor, start_output(data_path))
+                    if carla_session is None and not stand_in:
+                        carla_session = create_carla_session(job_args)
+                    if not stop.is_set() and runner(job_args, cfg, carla_session):
+                        size = finish_output(data_path)
+                        status = DONE
+                    else:
+                        error, cancelled = 'cancelled', True
+                except KeyboardInterrupt:
+                    error, cancelled = 'cancelled', True
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.exception('Simulation of junction %s failed.', junc_id)
+                    error = repr(e)
+            results.put({'junction': junc_id, 'status': status, 'slot': slot,
+                         'duration': time.time() - start, 'size': size, 'error': error})
+            if cancelled:
+                return
+    except KeyboardInterrupt:
+        # Cancelled while waiting for a job.
+        return
+
+
+def _stop_workers(workers, stop, timeout=30.0):
+    """
+    Cancels the running junctions and waits up to timeout seconds for the workers to clean up,
+    then kills the workers left and their sumo servers.
+    """
+    stop.set()
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+    deadline = time.time() + timeout
+    for worker in workers:
+        worker.join(max(0.0, deadline - time.time()))
+    for worker in workers:
+        if worker.is_alive():
+            logging.warning('Worker %s did not stop in %.0f s, killing it.', worker.name, timeout)
+            if hasattr(os, 'killpg'):
+                try:
+                    os.killpg(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            else:
+                worker.kill()
+            worker.join(timeout)
+
+
+def run_campaign(args, sensor_cfg, junctions, slots, stand_in=False, manifest=None):
+    """
+    Simulates the given junctions on one worker process per (carla_port, sumo_port) slot. The
+    junctions are taken from a shared work queue, the data of junction <id> goes to
+    <root_path>/j<id> and its log to <root_path>/.campaign/logs/j<id>.log.
+
+        :param junctions: {junction_id: junction_coordinates}
+        :param slots: [(carla_port, sumo_port), ...]
+        :param stand_in: simulate with run_stand_in_junction instead of carla and sumo.
+        :param manifest: CampaignManifest updated with the progress of the junctions.
+        :returns dict: {junction_id: result}, result has the keys status ('done' or 'failed'),
+                       slot, duration, size and error.
+    """
+    root_path = sensor_cfg['root_path']
+    log_path = campaign_path(root_path, 'logs')
+    os.makedirs(log_path, exist_ok=True)
+
+    # The simulator clients keep global state (e.g. the traci connection), so the workers are
+    # processes, not threads.
+    ctx = multiprocessing.get_context('spawn')
+    jobs = ctx.Queue()
+    results = ctx.Queue()
+    for junc_id, junc_coor in junctions.items():
+        jobs.put((junc_id, junc_coor, os.path.join(root_path, 'j' + junc_id)))
+    for _ in slots:
+        jobs.put(None)
+
+    stop = ctx.Event()
+    workers = [ctx.Process(target=_worker, name='campaign-%d' % slot[0],
+                           args=(slot, args, sensor_cfg, log_path, jobs, results, stand_in, stop))
+               for slot in slots]
+    for worker in workers:
+        worker.start()
+
+    finished = {}
+
+    def record(result):
+        if result['status'] == RUNNING:
+            logging.info('Junction %s started on slot %s.', result['junction'], result['slot'])
+            if manifest is not None:
+                manifest.mark_running(result['junction'], result['slot'])
+            return
+        finished[result['junction']] = result
+        if manifest is not None and result['status'] == DONE:
+            manifest.mark_done(result['junction'], result['duration'], result['size'])
+        elif manifest is not None:
+            manifest.mark_failed(result['junction'], result['duration'], result['error'])
+        logging.info('Junction %s %s in %.1f s (%d/%d).', result['junction'], result['status'],
+                     result['duration'], len(finished), len(junctions))
+
+    try:
+        while len(finished) < len(junctions):
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    logging.error('All campaign workers exited, %d junctions left.',
+                                  len(junctions) - len(finished))
+                    break
+                continue
+            record(result)
+    except KeyboardInterrupt:
+        logging.info('Campaign cancelled by user, stopping the workers.')
+        _stop_workers(workers, stop)
+        # Junctions cancelled while the workers stopped.
+        while True:
+            try:
+                record(results.get(timeout=0.1))
+            except queue.Empty:
+                break
+    except BaseException:
+        _stop_workers(workers, stop)
+        raise
+    for worker in workers:
+        worker.join()
+    return finished
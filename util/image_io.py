@@ -0,0 +1,81 @@
+""" Image encoders for the camera callbacks and the matching reader. """
+
+import os
+
+import numpy as np
+from PIL import Image
+
+from util.color_encoding import LABEL_COLORS
+
+# Encoder specifications, as given in the 'encoder' entry of the 'cameras' config block:
+#   {"type": "png", "compress_level": 0-9}     lossless, PIL default level is 6
+#   {"type": "npy"}                            raw uint8 array, no compression
+#   {"type": "jpeg", "quality": 1-95}          lossy
+#   {"type": "webp", "method": 0-6}            lossless WebP, method trades speed for size
+DEFAULT_ENCODER = {'type': 'png', 'compress_level': 6}
+
+_EXTENSIONS = {'png': 'png', 'npy': 'npy', 'jpeg': 'jpg', 'webp': 'webp'}
+
+
+def get_encoder(cfg, sensor_name):
+    """
+    Returns the encoder specification of the given camera from the 'cameras' config block. The
+    'encoder' entry maps sensor names to specifications, e.g.
+    {"camera": {"type": "jpeg", "quality": 90}, "camera_sem": {"type": "png", "compress_level": 1}}.
+    """
+    return cfg.get('encoder', {}).get(sensor_name, DEFAULT_ENCODER)
+
+
+def get_extension(encoder):
+    """
+    Returns the file extension (without dot) written by the given encoder.
+    """
+    if encoder['type'] not in _EXTENSIONS:
+        raise ValueError('image encoder "%s" is not supported.' % encoder['type'])
+    return _EXTENSIONS[encoder['type']]
+
+
+def write_image(array, file_name, encoder=DEFAULT_ENCODER):
+    """
+    Encodes an image array (H x W x C or H x W, uint8) to file with the given encoder.
+    """
+    encoder_type = encoder['type']
+    if encoder_type == 'npy':
+        np.save(file_name, array)
+    elif encoder_type == 'png':
+        Image.fromarray(array).save(file_name, format='PNG',
+                                    compress_level=encoder.get('compress_level', 6))
+    elif encoder_type == 'jpeg':
+        Image.fromarray(array).save(file_name, format='JPEG', quality=encoder.get('quality', 90))
+    elif encoder_type == 'webp':
+        Image.fromarray(array).save(file_name, format='WEBP', lossless=True,
+                                    method=encoder.get('method', 0))
+    else:
+        raise ValueError('image encoder "%s" is not supported.' % encoder_type)
+
+
+def read_image(file_name):
+    """
+    Reads an image written by write_image. '.npy' files are memory-mapped.
+        :returns: uint8 array, H x W x C or H x W.
+    """
+    if os.path.splitext(file_name)[1] == '.npy':
+        return np.load(file_name, mmap_mode='r')
+    with Image.open(file_name) as img:
+        return np.asarray(img)
+
+
+# CityScapes palette in the channel order of the camera images written by the callbacks: the first
+# three channels of carla's BGRA buffer, i.e. blue, green, red.
+_PALETTE_BGR = LABEL_COLORS.astype(np.uint8)[:, ::-1]
+
+
+def labels_to_palette(labels):
+    """
+    Renders a semantic label map (H x W, uint8 carla tags) with the CityScapes palette, as the
+    camera callbacks write camera_sem images with "label_format": "palette" (the BGR channels of
+    the buffer converted by carla.ColorConverter.CityScapesPalette). Tags outside the palette get
+    its last color.
+        :returns: H x W x 3 uint8 image, in the channel order of the camera images.
+    """
+    return np.take(_PALETTE_BGR, labels, axis=0, mode='clip')
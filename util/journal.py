@@ -0,0 +1,161 @@
+""" Append-only journal storage for raw sensor data, replacing the directory-per-vehicle tree. """
+
+import mmap
+import os
+import threading
+
+import numpy as np
+
+from util.meta_log import META_RECORD_DTYPE, SENSOR_NAMES, make_meta_record
+
+# The index of a journal holds the meta record of every frame plus the location of its raw payload
+# (the carla raw_data buffer) in the journal files.
+JOURNAL_INDEX_DTYPE = np.dtype(META_RECORD_DTYPE.descr + [
+    ('file_index', '<u2'),
+    ('offset', '<u8'),
+    ('length', '<u8'),
+])
+
+
+def _journal_file(journal_path, sensor_name, file_index):
+    return os.path.join(journal_path, '%s.%03d.jrn' % (sensor_name, file_index))
+
+
+def _index_file(journal_path, sensor_name):
+    return os.path.join(journal_path, '%s.idx' % sensor_name)
+
+
+class _SensorJournalFile(object):
+    """
+    Journal files and index of a single sensor type.
+    """
+    def __init__(self, journal_path, sensor_name, max_file_size):
+        self.journal_path = journal_path
+        self.sensor_name = sensor_name
+        self.max_file_size = max_file_size
+
+        self.lock = threading.Lock()
+        self.file_index = 0
+        self.offset = 0
+        self.fh = open(_journal_file(journal_path, sensor_name, 0), 'wb')
+        self.index_fh = open(_index_file(journal_path, sensor_name), 'wb')
+
+    def append(self, record, payload):
+        length = len(payload)
+        with self.lock:
+            if self.offset > 0 and self.offset + length > self.max_file_size:
+                self.fh.close()
+                self.file_index += 1
+                self.offset = 0
+                self.fh = open(_journal_file(self.journal_path, self.sensor_name, self.file_index), 'wb')
+
+            record['file_index'] = self.file_index
+            record['offset'] = self.offset
+            record['length'] = length
+            self.fh.write(payload)
+            self.index_fh.write(record.tobytes())
+            self.offset += length
+
+    def close(self):
+        with self.lock:
+            self.fh.close()
+            self.index_fh.close()
+
+
+class SensorJournal(object):
+    """
+    SensorJournal appends the raw payload of every sensor frame to one journal file per sensor type
+    ('<sensor>.000.jrn', rolled over every max_file_size bytes) and its meta record to the sidecar
+    index '<sensor>.idx'. Frames are appended from the sensor writer threads.
+    """
+    def __init__(self, journal_path, max_file_size=4 << 30):
+        self.journal_path = journal_path
+        self.max_file_size = max_file_size
+        if not os.path.exists(journal_path):
+            os.makedirs(journal_path)
+
+        self._lock = threading.Lock()
+        self._files = {}  # {sensor_name: _SensorJournalFile}
+
+    def _get_file(self, sensor_name):
+        with self._lock:
+            if sensor_name not in self._files:
+                self._files[sensor_name] = _SensorJournalFile(self.journal_path, sensor_name,
+                                                              self.max_file_size)
+            return self._files[sensor_name]
+
+    def append(self, sensor_name, sensor_id, parent_id, data):
+        """
+        Appends a carla image or lidar measurement to the journal.
+        """
+        record = make_meta_record(sensor_name, sensor_id, parent_id, data, dtype=JOURNAL_INDEX_DTYPE)
+        self._get_file(sensor_name).append(record, data.raw_data)
+
+    def close(self):
+        with self._lock:
+            for journal_file in self._files.values():
+                journal_file.close()
+
+
+class SensorJournalReader(object):
+    """
+    SensorJournalReader gives random access to the frames of a journal by (frame, vehicle, sensor).
+    Payloads are returned as read-only views into the memory-mapped journal files.
+    """
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.indexes = {}  # {sensor_name: index records}
+        self._rows = {}  # {(frame, vehicle_id, sensor_name): row}
+        self._maps = {}  # {(sensor_name, file_index): mmap}
+
+        for sensor_name in SENSOR_NAMES:
+            index_file = _index_file(journal_path, sensor_name)
+            if not os.path.exists(index_file):
+                continue
+            # Ignore a truncated record at the end of the index (run interrupted while appending).
+            n_records = os.path.getsize(index_file) // JOURNAL_INDEX_DTYPE.itemsize
+            index = np.fromfile(index_file, dtype=JOURNAL_INDEX_DTYPE, count=n_records)
+            self.indexes[sensor_name] = index
+            for row, (frame, parent_id) in enumerate(zip(index['frame'].tolist(),
+                                                         index['parent_id'].tolist())):
+                self._rows[(frame, parent_id, sensor_name)] = row
+
+    @property
+    def sensor_names(self):
+        return list(self.indexes.keys())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def keys(self):
+        """
+        Returns the (frame, vehicle_id, sensor_name) keys of all the frames in the journal.
+        """
+        return self._rows.keys()
+
+    def _get_map(self, sensor_name, file_index):
+        key = (sensor_name, file_index)
+        if key not in self._maps:
+            with open(_journal_file(self.journal_path, sensor_name, file_index), 'rb') as f:
+                self._maps[key] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[key]
+
+    def get_record(self, sensor_name, row):
+        """
+        Returns the index record and the raw payload of the given row of a sensor index.
+        """
+        record = self.indexes[sensor_name][row]
+        if record['length'] == 0:
+            return record, memoryview(b'')
+        journal_map = self._get_map(sensor_name, int(record['file_index']))
+        offset = int(record['offset'])
+        return record, memoryview(journal_map)[offset:offset + int(record['length'])]
+
+    def get(self, frame, vehicle_id, sensor_name):
+        """
+        Returns the index record and the raw payload of a frame, or None if it is not in the journal.
+        """
+        row = self._rows.get((frame, vehicle_id, sensor_name))
+        if row is None:
+            return None
+        return self.get_record(sensor_name, row)
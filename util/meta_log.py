@@ -0,0 +1,164 @@
+""" Append-only binary log holding the meta information of all the sensor frames of a run. """
+
+import functools
+import os
+import threading
+
+import numpy as np
+
+SENSOR_NAMES = ['camera', 'camera_sem', 'lidar', 'lidar_sem']
+MAX_LIDAR_CHANNELS = 64
+
+# One fixed-width record per sensor frame. Camera records leave the lidar fields at zero and vice
+# versa. The pose is the sensor transform in carla world coordinates (degrees and meters).
+META_RECORD_DTYPE = np.dtype([
+    ('frame', '<u4'),
+    ('timestamp', '<f8'),
+    ('sensor_id', '<u4'),
+    ('parent_id', '<u4'),
+    ('sensor_type', 'u1'),  # index in SENSOR_NAMES
+    ('roll', '<f8'), ('pitch', '<f8'), ('yaw', '<f8'),
+    ('x', '<f8'), ('y', '<f8'), ('z', '<f8'),
+    ('fov', '<f4'),
+    ('height', '<u2'),
+    ('width', '<u2'),
+    ('horizontal_angle', '<f4'),
+    ('channels', '<u2'),
+    ('point_counts', '<u4', (MAX_LIDAR_CHANNELS,)),
+])
+
+
+def make_meta_record(sensor_name, sensor_id, parent_id, data, dtype=META_RECORD_DTYPE):
+    """
+    Returns the meta record (array of length 1) of a carla image or lidar measurement. dtype may
+    extend META_RECORD_DTYPE with additional fields, which are left at zero.
+    """
+    record = np.zeros(1, dtype=dtype)
+    record['frame'] = data.frame
+    record['timestamp'] = data.timestamp
+    record['sensor_id'] = sensor_id
+    record['parent_id'] = parent_id
+    record['sensor_type'] = SENSOR_NAMES.index(sensor_name)
+
+    loc = data.transform.location
+    rot = data.transform.rotation
+    record['roll'], record['pitch'], record['yaw'] = rot.roll, rot.pitch, rot.yaw
+    record['x'], record['y'], record['z'] = loc.x, loc.y, loc.z
+
+    if 'camera' in sensor_name:
+        record['fov'] = data.fov
+        record['height'] = data.height
+        record['width'] = data.width
+    else:
+        channels = min(data.channels, MAX_LIDAR_CHANNELS)
+        record['horizontal_angle'] = data.horizontal_angle
+        record['channels'] = data.channels
+        record['point_counts'][0, :channels] = [data.get_point_count(c) for c in range(channels)]
+    return record
+
+
+class MetaLog(object):
+    """
+    MetaLog appends the meta information of every sensor frame to a single binary file instead of
+    writing one '_meta.txt' file per frame. Records can be appended from several writer threads.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._fh = open(file_name, 'ab')
+        self._lock = threading.Lock()
+
+    def append(self, sensor_name, sensor_id, parent_id, file_name, data):
+        """
+        Appends the meta information of a carla image or lidar measurement. The signature matches
+        write_image_meta_info / write_lidar_meta_info once the sensor is bound (see writer_for).
+        """
+        record = make_meta_record(sensor_name, sensor_id, parent_id, data)
+        with self._lock:
+            self._fh.write(record.tobytes())
+
+    def writer_for(self, sensor_name, sensor_id, parent_id):
+        """
+        Returns a meta writer with the (file_name, data) signature used by the sensor callbacks.
+        """
+        return functools.partial(self.append, sensor_name, sensor_id, parent_id)
+
+    def close(self):
+        """
+        Closes the log and writes its sorted index next to it ('<file_name>.idx.npy').
+        """
+        with self._lock:
+            self._fh.close()
+        write_meta_index(self.file_name)
+
+
+def _pack_keys(frames, parent_ids, sensor_types):
+    # frame: 32 bits, parent id: 24 bits, sensor type: 8 bits
+    return (frames.astype(np.uint64) << np.uint64(32)) \
+           | ((parent_ids.astype(np.uint64) & np.uint64(0xFFFFFF)) << np.uint64(8)) \
+           | sensor_types.astype(np.uint64)
+
+
+def _load_records(file_name):
+    # A crash while appending may leave a truncated record at the end of the log.
+    n_records = os.path.getsize(file_name) // META_RECORD_DTYPE.itemsize
+    if n_records == 0:
+        return np.zeros(0, dtype=META_RECORD_DTYPE)
+    return np.memmap(file_name, dtype=META_RECORD_DTYPE, mode='r', shape=(n_records,))
+
+
+def _build_index(records):
+    keys = _pack_keys(records['frame'], records['parent_id'], records['sensor_type'])
+    order = np.argsort(keys, kind='stable')
+    index = np.zeros(len(records), dtype=[('key', '<u8'), ('row', '<u8')])
+    index['key'] = keys[order]
+    index['row'] = order
+    return index
+
+
+def write_meta_index(file_name):
+    """
+    Writes the index of a meta log: its records sorted by (frame, parent id, sensor type).
+    """
+    np.save(file_name + '.idx.npy', _build_index(_load_records(file_name)))
+
+
+class MetaLogReader(object):
+    """
+    MetaLogReader memory-maps a meta log and its index and looks records up by
+    (frame, parent_id, sensor_name) with a binary search.
+    """
+    def __init__(self, file_name):
+        self.records = _load_records(file_name)
+
+        # The index is rebuilt in memory if the run did not close the log properly.
+        index_file = file_name + '.idx.npy'
+        index = np.load(index_file, mmap_mode='r') if os.path.exists(index_file) else None
+        if index is None or len(index) != len(self.records):
+            index = _build_index(self.records)
+        self._sorted_keys = index['key']
+        self._rows = index['row']
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, frame, parent_id, sensor_name):
+        """
+        Returns the record of the given frame, vehicle and sensor, or None if it was not logged.
+        """
+        key = _pack_keys(np.array([frame]), np.array([parent_id]),
+                         np.array([SENSOR_NAMES.index(sensor_name)]))[0]
+        i = np.searchsorted(self._sorted_keys, key)
+        if i == len(self._sorted_keys) or self._sorted_keys[i] != key:
+            return None
+        return self.records[self._rows[i]]
+
+    def select(self, parent_id=None, sensor_name=None):
+        """
+        Returns all the records of the given vehicle and/or sensor.
+        """
+        mask = np.ones(len(self.records), dtype=bool)
+        if parent_id is not None:
+            mask &= self.records['parent_id'] == parent_id
+        if sensor_name is not None:
+            mask &= self.records['sensor_type'] == SENSOR_NAMES.index(sensor_name)
+        return self.records[mask]
@@ -0,0 +1,143 @@
+""" Binary point cloud files written by the lidar callbacks and the matching readers. """
+
+import os
+
+import numpy as np
+
+# Layout of the carla.LidarMeasurement raw buffer. Lidar '.bin' files are a plain dump of this
+# buffer: one 16 bytes record per point, no header, little endian, carla (left-handed) sensor
+# coordinates.
+LIDAR_DTYPE = np.dtype([
+    ('x', np.float32), ('y', np.float32), ('z', np.float32), ('intensity', np.float32)])
+
+# Layout of the carla.SemanticLidarMeasurement raw buffer. Semantic lidar '.bin' files are a plain
+# dump of this buffer: one 24 bytes record per point, no header, little endian, carla (left-handed)
+# sensor coordinates.
+SEMANTIC_LIDAR_DTYPE = np.dtype([
+    ('x', np.float32), ('y', np.float32), ('z', np.float32),
+    ('CosAngle', np.float32), ('ObjIdx', np.uint32), ('ObjTag', np.uint32)])
+
+
+def write_raw_bin(point_cloud, file_name):
+    """
+    Writes the raw buffer of a carla lidar measurement to file without copying it.
+    """
+    with open(file_name, 'wb') as f:
+        f.write(point_cloud.raw_data)
+
+
+def _read_bin(file_name, dtype):
+    if os.path.getsize(file_name) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_name, dtype=dtype, mode='r')
+
+
+def read_lidar_bin(file_name):
+    """
+    Memory-maps a lidar '.bin' file.
+        :returns: read-only structured array with the fields of LIDAR_DTYPE.
+    """
+    return _read_bin(file_name, LIDAR_DTYPE)
+
+
+def read_semantic_lidar_bin(file_name):
+    """
+    Memory-maps a semantic lidar '.bin' file.
+        :returns: read-only structured array with the fields of SEMANTIC_LIDAR_DTYPE.
+    """
+    return _read_bin(file_name, SEMANTIC_LIDAR_DTYPE)
+
+
+def semantic_lidar_points(data):
+    """
+    Returns the points (N x 3, float64) and labels (N, uint32) of a semantic lidar record array.
+    The y axis is negated to match the right-handed coordinates of the '.pcd' files.
+    """
+    points = np.stack([data['x'], -data['y'], data['z']], axis=1).astype(np.float64)
+    return points, np.asarray(data['ObjTag'])
+
+
+# Compact point cloud files ('.cbin'): a 48 bytes header followed by the quantized coordinates
+# (N x 3, int16 or int32) and the labels (N, uint8), i.e. 7 bytes/point with int16 coordinates and
+# 13 bytes/point with int32 coordinates. Decoded coordinates are within resolution / 2 (plus
+# float32 rounding) of the original ones.
+COMPACT_MAGIC = b'CPC1'
+COMPACT_HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('coord_bytes', '<u4'),  # 2: int16, 4: int32
+    ('n_points', '<u8'),
+    ('resolution', '<f8'),
+    ('origin', '<f8', (3,)),
+])
+_COMPACT_COORD_DTYPES = {2: np.dtype('<i2'), 4: np.dtype('<i4')}
+
+
+def encode_compact(points, labels, resolution=0.001, coord_bytes=None):
+    """
+    Quantizes a labeled point cloud.
+        :param points: N x 3 coordinates.
+        :param labels: N labels (0-255).
+        :param resolution: quantization step in meters.
+        :param coord_bytes: 2 (int16) or 4 (int32) per coordinate. By default int16 is used when
+                            the cloud spans at most 65534 steps on every axis (65.5 m at 1 mm,
+                            196 m at 3 mm), int32 otherwise.
+        :returns: (header, quantized coordinates, uint8 labels)
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    labels = np.asarray(labels).reshape(-1)
+    if len(labels) != len(points):
+        raise ValueError('%d labels for %d points.' % (len(labels), len(points)))
+    if len(labels) > 0 and (labels.min() < 0 or labels.max() > 255):
+        raise ValueError('labels must be in 0-255, got %d-%d.' % (labels.min(), labels.max()))
+
+    if len(points) > 0:
+        origin = np.round((points.min(axis=0) + points.max(axis=0)) / 2.0 / resolution) * resolution
+        quantized = np.rint((points - origin) / resolution)
+    else:
+        origin = np.zeros(3)
+        quantized = np.zeros((0, 3))
+
+    max_abs = np.abs(quantized).max() if len(quantized) > 0 else 0
+    if coord_bytes is None:
+        coord_bytes = 2 if max_abs <= np.iinfo(np.int16).max else 4
+    if max_abs > np.iinfo(_COMPACT_COORD_DTYPES[coord_bytes]).max:
+        raise ValueError('the cloud does not fit in %d bytes coordinates at a resolution of %g m.'
+                         % (coord_bytes, resolution))
+
+    header = np.zeros(1, dtype=COMPACT_HEADER_DTYPE)
+    header['magic'] = COMPACT_MAGIC
+    header['coord_bytes'] = coord_bytes
+    header['n_points'] = len(points)
+    header['resolution'] = resolution
+    header['origin'] = origin
+    return header, quantized.astype(_COMPACT_COORD_DTYPES[coord_bytes]), labels.astype(np.uint8)
+
+
+def write_compact(file_name, points, labels, resolution=0.001, coord_bytes=None):
+    """
+    Writes a labeled point cloud to a compact '.cbin' file, see encode_compact.
+    """
+    header, quantized, labels = encode_compact(points, labels, resolution, coord_bytes)
+    with open(file_name, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(quantized.tobytes())
+        f.write(labels.tobytes())
+
+
+def read_compact(file_name):
+    """
+    Reads a compact '.cbin' file.
+        :returns: points (N x 3, float32) and labels (N, uint8).
+    """
+    with open(file_name, 'rb') as f:
+        header = np.frombuffer(f.read(COMPACT_HEADER_DTYPE.itemsize), dtype=COMPACT_HEADER_DTYPE)[0]
+        if header['magic'] != COMPACT_MAGIC:
+            raise ValueError('%s is not a compact point cloud file.' % file_name)
+        n_points = int(header['n_points'])
+        coord_dtype = _COMPACT_COORD_DTYPES[int(header['coord_bytes'])]
+        quantized = np.fromfile(f, dtype=coord_dtype, count=3 * n_points).reshape(-1, 3)
+        labels = np.fromfile(f, dtype=np.uint8, count=n_points)
+
+    points = quantized.astype(np.float32) * np.float32(header['resolution']) \
+             + header['origin'].astype(np.float32)
+    return points, labels
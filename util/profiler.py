@@ -0,0 +1,103 @@
+""" Per-phase timing of the simulation tick, with an optional Chrome trace timeline. """
+
+import contextlib
+import json
+import threading
+import time
+
+import numpy as np
+
+_NULL_PHASE = contextlib.nullcontext()
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class TickProfiler(object):
+    """
+    TickProfiler collects the durations of named phases, e.g.
+
+        with profiler.phase('carla_tick'):
+            carla.tick()
+
+    Phases may be timed from any thread (tick, sensor writers, carla sensor callbacks). A disabled
+    profiler hands out a shared no-op context manager and records nothing. With trace=True, every
+    phase is also kept as an event of a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+    """
+    def __init__(self, enabled=False, trace=False):
+        self.enabled = enabled or trace
+        self.trace = trace
+
+        self._origin = time.perf_counter()
+        self._durations = {}  # {phase name: [seconds, ...]}
+        self._events = []  # [(name, thread id, start, end), ...]
+        self._threads = {}  # {thread id: thread name}
+
+    def phase(self, name):
+        """
+        Returns a context manager timing the enclosed block as the given phase.
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def record(self, name, start, end):
+        """
+        Records a phase measured with time.perf_counter().
+        """
+        if not self.enabled:
+            return
+        self._durations.setdefault(name, []).append(end - start)
+        if self.trace:
+            thread = threading.current_thread()
+            self._threads[thread.ident] = thread.name
+            self._events.append((name, thread.ident, start, end))
+
+    def get_stats(self):
+        """
+        Returns count, total, mean, p50, p95 and max duration of every phase.
+            :returns dict: {phase name: {'count': ..., 'total_s': ..., 'p50_ms': ..., ...}}
+        """
+        stats = {}
+        for name, durations in list(self._durations.items()):
+            durations = np.array(durations) * 1000.0
+            stats[name] = {
+                'count': len(durations),
+                'total_s': float(durations.sum() / 1000.0),
+                'mean_ms': float(durations.mean()),
+                'p50_ms': float(np.percentile(durations, 50)),
+                'p95_ms': float(np.percentile(durations, 95)),
+                'max_ms': float(durations.max()),
+            }
+        return stats
+
+    def write_report(self, file_name):
+        """
+        Writes the phase statistics as JSON.
+        """
+        with open(file_name, 'w') as f:
+            json.dump(self.get_stats(), f, indent=2, sort_keys=True)
+
+    def write_trace(self, file_name):
+        """
+        Writes the recorded phases in the Chrome trace event format.
+        """
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': name}}
+                  for tid, name in self._threads.items()]
+        for name, tid, start, end in list(self._events):
+            events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': tid,
+                           'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6})
+        with open(file_name, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,182 @@
+""" Live publishing of sensor frames through a shared-memory ring buffer. """
+
+import logging
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from util.meta_log import SENSOR_NAMES
+from util.pointcloud_io import LIDAR_DTYPE, SEMANTIC_LIDAR_DTYPE
+
+RING_MAGIC = b'CSFR'
+RING_HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('n_slots', '<u4'),
+    ('slot_size', '<u8'),
+    ('count', '<u8'),  # number of frames published so far
+])
+
+# Each slot holds this header followed by the raw carla buffer of the frame. 'seq' is odd while
+# the publisher is writing the slot and 2 * (index of the frame + 1) once it is complete.
+SLOT_HEADER_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('frame', '<u4'),
+    ('sensor_id', '<u4'),
+    ('parent_id', '<u4'),
+    ('sensor_type', '<u4'),  # index in SENSOR_NAMES
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('length', '<u8'),
+    ('timestamp', '<f8'),
+    ('publish_time', '<f8'),  # time.time() of the publisher
+    ('pose', '<f8', (6,)),  # roll, pitch, yaw, x, y, z of the sensor
+])
+
+_RING_HEADER_SIZE = 64
+
+
+def _slot_offset(slot, slot_size):
+    return _RING_HEADER_SIZE + slot * (SLOT_HEADER_DTYPE.itemsize + slot_size)
+
+
+class FramePublisher(object):
+    """
+    FramePublisher copies each sensor frame (raw carla buffer plus frame id, vehicle id and pose)
+    into a named shared-memory ring buffer of n_slots slots, so that a perception or fusion process
+    can consume the frames live (see FrameSubscriber). The publisher never waits for subscribers:
+    slow subscribers lose the oldest frames.
+    """
+    def __init__(self, name, n_slots=16, slot_size=4 << 20, sensor_names=None):
+        self.name = name
+        self.n_slots = n_slots
+        self.slot_size = slot_size
+        self.sensor_names = sensor_names
+
+        size = _slot_offset(n_slots, slot_size)
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left over by a crashed run.
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self._header = np.ndarray(1, dtype=RING_HEADER_DTYPE, buffer=self._shm.buf)
+        self._header['magic'] = RING_MAGIC
+        self._header['n_slots'] = n_slots
+        self._header['slot_size'] = slot_size
+        self._header['count'] = 0
+        self._slots = [np.ndarray(1, dtype=SLOT_HEADER_DTYPE, buffer=self._shm.buf,
+                                  offset=_slot_offset(i, slot_size)) for i in range(n_slots)]
+        self.n_dropped = 0
+
+    def publish(self, sensor_name, sensor_id, parent_id, data):
+        """
+        Publishes a carla image or lidar measurement.
+        """
+        if self.sensor_names is not None and sensor_name not in self.sensor_names:
+            return
+        payload = memoryview(data.raw_data).cast('B')
+        if payload.nbytes > self.slot_size:
+            self.n_dropped += 1
+            logging.warning('Frame %d of sensor %d (%d bytes) does not fit in the publisher slots.',
+                            data.frame, sensor_id, payload.nbytes)
+            return
+
+        count = int(self._header['count'][0])
+        slot = count % self.n_slots
+        header = self._slots[slot]
+        header['seq'] = 2 * count + 1
+        header['frame'] = data.frame
+        header['sensor_id'] = sensor_id
+        header['parent_id'] = parent_id
+        header['sensor_type'] = SENSOR_NAMES.index(sensor_name)
+        header['width'] = getattr(data, 'width', 0)
+        header['height'] = getattr(data, 'height', 0)
+        header['length'] = payload.nbytes
+        header['timestamp'] = data.timestamp
+        rot, loc = data.transform.rotation, data.transform.location
+        header['pose'] = (rot.roll, rot.pitch, rot.yaw, loc.x, loc.y, loc.z)
+
+        start = _slot_offset(slot, self.slot_size) + SLOT_HEADER_DTYPE.itemsize
+        self._shm.buf[start:start + payload.nbytes] = payload
+        header['publish_time'] = time.time()
+        header['seq'] = 2 * count + 2
+        self._header['count'] = count + 1
+
+    def close(self):
+        self._header = None
+        self._slots = []
+        self._shm.close()
+        self._shm.unlink()
+
+
+class FrameSubscriber(object):
+    """
+    FrameSubscriber reads the frames of a FramePublisher ring buffer in publishing order.
+    """
+    def __init__(self, name):
+        self._shm = shared_memory.SharedMemory(name=name)
+        # The publisher owns the segment, do not let the resource tracker unlink it at exit.
+        resource_tracker.unregister(self._shm._name, 'shared_memory')  # pylint: disable=protected-access
+
+        self._header = np.ndarray(1, dtype=RING_HEADER_DTYPE, buffer=self._shm.buf)
+        if self._header['magic'][0] != RING_MAGIC:
+            raise ValueError('shared memory %s is not a frame ring buffer.' % name)
+        self.n_slots = int(self._header['n_slots'][0])
+        self.slot_size = int(self._header['slot_size'][0])
+        self._slots = [np.ndarray(1, dtype=SLOT_HEADER_DTYPE, buffer=self._shm.buf,
+                                  offset=_slot_offset(i, self.slot_size)) for i in range(self.n_slots)]
+
+        self.cursor = int(self._header['count'][0])  # only new frames are read
+        self.n_lost = 0
+
+    def poll(self):
+        """
+        Returns the next frame as (header, payload copy), or None if no new frame is available.
+        """
+        while True:
+            count = int(self._header['count'][0])
+            if self.cursor >= count:
+                return None
+            if count - self.cursor > self.n_slots:
+                # The publisher overwrote frames we did not read yet.
+                self.n_lost += count - self.n_slots - self.cursor
+                self.cursor = count - self.n_slots
+
+            slot = self.cursor % self.n_slots
+            expected_seq = 2 * self.cursor + 2
+            header = self._slots[slot][0].copy()
+            start = _slot_offset(slot, self.slot_size) + SLOT_HEADER_DTYPE.itemsize
+            payload = bytes(self._shm.buf[start:start + int(header['length'])])
+            if header['seq'] != expected_seq or self._slots[slot]['seq'][0] != expected_seq:
+                # Overwritten while we were reading it.
+                self.n_lost += 1
+                self.cursor += 1
+                continue
+            self.cursor += 1
+            return header, payload
+
+    def close(self):
+        self._header = None
+        self._slots = []
+        self._shm.close()
+
+
+def decode_frame(header, payload):
+    """
+    Decodes a published frame.
+        :returns: lidar: points (N x 3, float32, carla sensor coordinates) and labels (ObjTag for
+                  lidar_sem, intensity for lidar); cameras: the BGRA image (H x W x 4, uint8) and None.
+    """
+    sensor_name = SENSOR_NAMES[int(header['sensor_type'])]
+    if 'camera' in sensor_name:
+        image = np.frombuffer(payload, dtype=np.uint8).reshape(int(header['height']), int(header['width']), 4)
+        return image, None
+    dtype = SEMANTIC_LIDAR_DTYPE if sensor_name == 'lidar_sem' else LIDAR_DTYPE
+    data = np.frombuffer(payload, dtype=dtype)
+    points = np.stack([data['x'], data['y'], data['z']], axis=1)
+    labels = data['ObjTag'] if sensor_name == 'lidar_sem' else data['intensity']
+    return points, labels
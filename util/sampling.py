@@ -0,0 +1,100 @@
+""" Selection of the perception nodes among the vehicles in range of the ego vehicle. """
+
+import numpy as np
+
+
+def farthest_point_sampling(points, n_samples, start_index=0, distinct=False):
+    """
+    Incremental farthest point sampling. Starting from points[start_index], repeatedly picks the
+    point farthest from all the points picked so far. A running array of the distance of every
+    point to its nearest picked point is updated once per pick, so the cost is O(N * n_samples).
+    Ties go to the lowest index.
+
+        :param points: N x D array.
+        :param n_samples: number of points to pick, including the start point.
+        :param start_index: index of the first picked point, or list of the indices of the first
+                            picked points.
+        :param distinct: stop early instead of picking a point at the location of a picked point.
+        :return: list of the picked indices, in picking order.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n_samples = min(n_samples, len(points))
+    if n_samples <= 0:
+        return []
+
+    chosen = [int(i) for i in np.atleast_1d(start_index)]
+    min_dist = np.linalg.norm(points[:, None, :] - points[None, chosen, :], axis=2).min(axis=1)
+    min_dist[chosen] = -1.0
+    for _ in range(n_samples - len(chosen)):
+        idx = int(np.argmax(min_dist))
+        if distinct and min_dist[idx] <= 0:
+            break
+        chosen.append(idx)
+        np.minimum(min_dist, np.linalg.norm(points - points[idx], axis=1), out=min_dist)
+        min_dist[chosen] = -1.0
+    return chosen
+
+
+def coverage_radius(points, indices):
+    """
+    Largest distance of a point to its nearest point among points[indices]. The lower, the better
+    the picked points cover the others.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    return np.linalg.norm(points[:, None, :] - points[None, indices, :], axis=2).min(axis=1).max()
+
+
+def sample_actors(locations, start_actor, n_samples, distinct=False):
+    """
+    Farthest point sampling of actors.
+
+        :param locations: {actor_id: [x, y]}, must contain start_actor.
+        :return: set of the picked actor ids.
+    """
+    actors = list(locations.keys())
+    points = np.array([locations[actor] for actor in actors], dtype=np.float64)
+    choosen = farthest_point_sampling(points, n_samples, actors.index(start_actor), distinct)
+    return set(actors[i] for i in choosen)
+
+
+class HysteresisSampler(object):
+    """
+    HysteresisSampler is a temporally stable farthest point sampling of actors. Picked actors are
+    kept as long as they are in the locations, the selection is only completed by farthest point
+    sampling when some left. An actor kept for at least min_ticks can be swapped, but only if the
+    fresh selection lowers the coverage radius by more than the given margin (fraction of the
+    current radius).
+    """
+    def __init__(self, n_samples, min_ticks=10, margin=0.2):
+        self.n_samples = n_samples
+        self.min_ticks = min_ticks
+        self.margin = margin
+        self.picked_at = {}  # actor id -> tick it was picked
+
+    def select(self, locations, start_actor, tick):
+        """
+        Returns the set of picked actor ids, always including start_actor.
+
+            :param locations: {actor_id: [x, y]}, must contain start_actor.
+            :param tick: current tick, to count for how long actors are picked.
+        """
+        if len(locations) <= self.n_samples:
+            picked = set(locations.keys())
+        else:
+            actors = list(locations.keys())
+            index = {actor: i for i, actor in enumerate(actors)}
+            points = np.array([locations[actor] for actor in actors], dtype=np.float64)
+
+            kept = [actor for actor in self.picked_at if actor in index and actor != start_actor]
+            kept = [start_actor] + kept[:self.n_samples - 1]
+            current = farthest_point_sampling(points, self.n_samples, [index[actor] for actor in kept])
+
+            locked = [start_actor] + [actor for actor in kept[1:] if tick - self.picked_at[actor] < self.min_ticks]
+            if len(locked) < len(kept):
+                candidate = farthest_point_sampling(points, self.n_samples, [index[actor] for actor in locked])
+                if coverage_radius(points, candidate) < (1.0 - self.margin) * coverage_radius(points, current):
+                    current = candidate
+            picked = set(actors[i] for i in current)
+
+        self.picked_at = {actor: self.picked_at.get(actor, tick) for actor in picked}
+        return picked
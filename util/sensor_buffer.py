@@ -0,0 +1,117 @@
+""" Frame-indexed buffer collecting the data of all the active sensors for a simulation tick. """
+
+import threading
+import time
+
+from util.profiler import TickProfiler
+
+
+class SensorFrameBuffer(object):
+    """
+    SensorFrameBuffer stores the sensor data delivered by the carla callbacks keyed by
+    (frame, sensor_id). After each world tick, retrieve() waits until every expected sensor has
+    delivered that frame (or the deadline passes), in the same way as CarlaSyncMode._retrieve_data.
+
+    Sensors with a sensor_tick longer than the simulation step are not expected: retrieve() does
+    not wait for them, and their data delivered after its frame was retrieved is handed to the next
+    retrieve() instead. Late data of expected sensors is dropped and counted as late; expected
+    sensors that did not deliver before the deadline are counted as missing.
+    """
+    def __init__(self, timeout=1.0, profiler=None):
+        self.timeout = timeout
+        self.profiler = profiler if profiler is not None else TickProfiler()
+
+        self._cond = threading.Condition()
+        self._frames = {}  # {frame: {sensor_id: (sensor_name, sensor_id, parent_id, data)}}
+        self._active = {}  # {sensor_id: expected}
+        self._last_frame = None
+        self._carried = []  # late data of not expected sensors, for the next retrieve()
+
+        self.n_delivered = 0
+        self.n_late = 0
+        self.n_missing = 0
+        self.n_stale = 0
+        self.n_carried = 0
+        self.n_dropped = 0
+
+    def activate(self, sensor_id, expected=True):
+        """
+        Registers a listening sensor. If expected is True, retrieve() waits for it on every frame.
+        """
+        with self._cond:
+            self._active[sensor_id] = expected
+
+    def deactivate(self, sensor_id):
+        """
+        Unregisters a stopped or destroyed sensor.
+        """
+        with self._cond:
+            self._active.pop(sensor_id, None)
+
+    def put(self, data, sensor_name, sensor_id, parent_id):
+        """
+        Sensor callback (runs on the carla client threads).
+        """
+        with self.profiler.phase('callback:' + sensor_name), self._cond:
+            if self._last_frame is not None and data.frame <= self._last_frame:
+                if self._active.get(sensor_id, True):
+                    self.n_late += 1
+                else:
+                    self._carried.append((sensor_name, sensor_id, parent_id, data))
+                    self.n_carried += 1
+                return
+            if data.frame not in self._frames:
+                self._frames[data.frame] = {}
+            self._frames[data.frame][sensor_id] = (sensor_name, sensor_id, parent_id, data)
+            self._cond.notify_all()
+
+    def retrieve(self, frame, timeout=None):
+        """
+        Waits until all the expected sensors delivered the given frame or the timeout expires.
+            :returns list: [(sensor_name, sensor_id, parent_id, data), ...] of the frame, and the
+                           data of not expected sensors delivered late for earlier frames.
+        """
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            expected = set(sensor_id for sensor_id, is_expected in self._active.items() if is_expected)
+            while not expected.issubset(self._frames.get(frame, {})):
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    break
+                self._cond.wait(remaining)
+
+            items = self._frames.pop(frame, {})
+            self.n_missing += len(expected.difference(items))
+
+            # Earlier frames will never be retrieved, only the data of not expected sensors is kept.
+            for stale_frame in sorted(f for f in self._frames if f < frame):
+                for sensor_id, item in self._frames.pop(stale_frame).items():
+                    if self._active.get(sensor_id, True):
+                        self.n_stale += 1
+                    else:
+                        self._carried.append(item)
+            self._last_frame = frame
+
+            result = self._carried + [items[sensor_id] for sensor_id in sorted(items)]
+            self._carried = []
+            self.n_delivered += len(result)
+
+        return result
+
+    def drop(self):
+        """
+        Counts a retrieved frame that could not be saved, e.g. carried data of a sensor or vehicle
+        destroyed in the meantime.
+        """
+        with self._cond:
+            self.n_dropped += 1
+
+    def get_stats(self):
+        """
+        Returns the number of delivered, late, missing and stale sensor frames, of late frames of not
+        expected sensors carried to the next retrieve(), and of retrieved frames dropped.
+        """
+        with self._cond:
+            return {'delivered': self.n_delivered, 'late': self.n_late,
+                    'missing': self.n_missing, 'stale': self.n_stale, 'carried': self.n_carried,
+                    'dropped': self.n_dropped}
@@ -0,0 +1,169 @@
+""" Background writer stage for sensor data, used to keep encoding and disk I/O off the tick path. """
+
+import logging
+import queue
+import threading
+import time
+
+from util.profiler import TickProfiler
+
+
+class _SensorWriterStats(object):
+    """
+    Write statistics of a single sensor.
+    """
+    def __init__(self):
+        self.pending = 0
+        self.max_pending = 0
+        self.written = 0
+        self.failed = 0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.stall_time = 0.0
+
+    def as_dict(self):
+        n = max(self.written + self.failed, 1)
+        return {
+            'queue_depth': self.pending,
+            'max_queue_depth': self.max_pending,
+            'written': self.written,
+            'failed': self.failed,
+            'mean_write_ms': self.write_time / n * 1000.0,
+            'max_write_ms': self.max_write_time * 1000.0,
+            'mean_latency_ms': self.latency / n * 1000.0,
+            'max_latency_ms': self.max_latency * 1000.0,
+            'stall_ms': self.stall_time * 1000.0,
+        }
+
+
+class SensorWriterPool(object):
+    """
+    SensorWriterPool runs the sensor data callbacks (image encoding, point cloud writing, ...) on
+    a pool of background threads.
+
+    The pending jobs are kept in a bounded queue. When the queue is full, submit() blocks until a
+    worker frees a slot, so the simulation is throttled to the disk/encoder throughput instead of
+    buffering frames without limit. With num_workers=0 the callbacks run inline on the caller
+    thread.
+    """
+    def __init__(self, num_workers=2, max_queue_depth=32, profiler=None):
+        self.num_workers = num_workers
+        self.max_queue_depth = max_queue_depth
+        self.profiler = profiler if profiler is not None else TickProfiler()
+
+        self._queue = queue.Queue(maxsize=max_queue_depth)
+        self._lock = threading.Lock()
+        self._stats = {}  # {sensor_name: _SensorWriterStats}
+
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._run, name='sensor-writer-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _get_stats(self, sensor_name):
+        if sensor_name not in self._stats:
+            self._stats[sensor_name] = _SensorWriterStats()
+        return self._stats[sensor_name]
+
+    def submit(self, sensor_name, callback, *args, **kwargs):
+        """
+        Queues a write job. Blocks while the queue holds max_queue_depth jobs.
+
+            :param sensor_name: name of the sensor, used to group the statistics.
+            :param callback: function writing the data.
+        """
+        with self._lock:
+            stats = self._get_stats(sensor_name)
+            stats.pending += 1
+            stats.max_pending = max(stats.max_pending, stats.pending)
+
+        submitted = time.time()
+        if not self._workers:
+            self._write(sensor_name, callback, args, kwargs, submitted)
+            return
+
+        self._queue.put((sensor_name, callback, args, kwargs, submitted))
+        stall = time.time() - submitted
+        if stall > 0.0:
+            with self._lock:
+                stats.stall_time += stall
+
+    def _write(self, sensor_name, callback, args, kwargs, submitted):
+        start = time.time()
+        failed = False
+        try:
+            with self.profiler.phase('write:' + sensor_name):
+                callback(*args, **kwargs)
+        except Exception:  # pylint: disable=broad-except
+            failed = True
+            logging.exception('Writing %s data failed.', sensor_name)
+        end = time.time()
+
+        with self._lock:
+            stats = self._get_stats(sensor_name)
+            stats.pending -= 1
+            if failed:
+                stats.failed += 1
+            else:
+                stats.written += 1
+            stats.write_time += end - start
+            stats.max_write_time = max(stats.max_write_time, end - start)
+            stats.latency += end - submitted
+            stats.max_latency = max(stats.max_latency, end - submitted)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(*job)
+            finally:
+                self._queue.task_done()
+
+    @property
+    def queue_depth(self):
+        """
+        Number of jobs waiting for a worker.
+        """
+        return self._queue.qsize()
+
+    def get_stats(self):
+        """
+        Returns the write statistics per sensor.
+            :returns dict: {sensor_name: {'queue_depth': ..., 'mean_write_ms': ..., ...}}
+        """
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+    def log_stats(self):
+        """
+        Logs the write statistics per sensor.
+        """
+        for name, stats in sorted(self.get_stats().items()):
+            logging.info('Sensor writer [%s]: written %d, failed %d, queue depth %d (max %d), '
+                         'write %.1f ms (max %.1f ms), latency %.1f ms (max %.1f ms), stalled %.1f ms',
+                         name, stats['written'], stats['failed'], stats['queue_depth'],
+                         stats['max_queue_depth'], stats['mean_write_ms'], stats['max_write_ms'],
+                         stats['mean_latency_ms'], stats['max_latency_ms'], stats['stall_ms'])
+
+    def flush(self):
+        """
+        Blocks until all the queued jobs are written.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes the remaining jobs and stops the workers.
+        """
+        self.flush()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
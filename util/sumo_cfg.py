@@ -0,0 +1,39 @@
+""" Sumo configuration files of the junctions. """
+
+import os
+
+
+def write_sumocfg(path, junction, base_dir=None):
+    """
+    Writes the sumo config of a junction. The files it refers to are relative to the directory of
+    the config, or absolute paths under base_dir if given (for a config written elsewhere).
+    """
+    def ref(file_name):
+        return file_name if base_dir is None else os.path.abspath(os.path.join(base_dir, file_name))
+
+    cfg_str = """<?xml version="1.0" encoding="UTF-8"?>
+    <configuration xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/sumoConfiguration.xsd">
+
+        <input>
+            <net-file value="{}"/>
+            <route-files value="{},{}"/>
+            <additional-files value="{}"/>
+        </input>
+    
+        <gui_only>
+            <gui-settings-file value="{}"/>
+        </gui_only>
+
+    </configuration>
+    """.format(ref('Town05.net.xml'), ref('../carlavtypes.rou.xml'), ref(junction + '/route.rou.xml'),
+               ref(junction + '/rerouter.add.xml'), ref('../viewsettings.xml'))
+    with open(path, 'w') as f:
+        f.write(cfg_str)
+
+
+def junction_sumocfg(data_path):
+    """
+    Path of the sumo config of a junction simulated into data_path. It is kept with the data of
+    the junction instead of the source tree, see write_sumocfg for the paths inside.
+    """
+    return os.path.join(data_path, 'sumo.sumocfg')
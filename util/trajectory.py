@@ -0,0 +1,190 @@
+""" Buffered binary recorder of the vehicle trajectories of a run, replacing info.csv. """
+
+import os
+
+import numpy as np
+
+# One row per vehicle and tick, with the columns of info.csv. The pose is the vehicle transform in
+# carla world coordinates (meters and degrees), the size is the bounding box (meters).
+# x, y, z are float64, the precision of the readers of the positions (distances, speeds by
+# differencing), at 12 bytes per row. roll, pitch, yaw and the size are float32: carla.Transform
+# and the bounding box extent hold single precision floats, so float32 stores the recorded values
+# exactly (the size is twice the extent, also exact) and the info.csv export is unchanged.
+TRAJECTORY_DTYPE = np.dtype([
+    ('frame', '<u4'),
+    ('vehicle_id', '<u4'),
+    ('type_index', '<u2'),  # line in the '<file_name>.types' file
+    ('x', '<f8'), ('y', '<f8'), ('z', '<f8'),
+    ('roll', '<f4'), ('pitch', '<f4'), ('yaw', '<f4'),
+    ('length', '<f4'), ('width', '<f4'), ('height', '<f4'),
+])
+
+# The file is a sequence of chunks: a header followed by each column of the chunk rows, in the
+# order of TRAJECTORY_DTYPE.
+TRAJECTORY_MAGIC = b'TRJ1'
+CHUNK_HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('n_rows', '<u4'),
+    ('first_frame', '<u4'),
+    ('last_frame', '<u4'),
+])
+
+FRAME_INDEX_DTYPE = np.dtype([('frame', '<u4'), ('row', '<u8'), ('count', '<u4')])
+
+INFO_CSV_HEADER = ['frame', 'vehicle_id', 'x', 'y', 'z', 'roll', 'pitch', 'yaw',
+                   'length', 'width', 'height']
+
+
+class TrajectoryRecorder(object):
+    """
+    TrajectoryRecorder buffers the rows of the ticks and appends them in chunks of about
+    chunk_rows rows to a binary columnar file. The vehicle type ids are appended to
+    '<file_name>.types' (one per line) and the frame index is written to '<file_name>.idx.npy' at
+    close().
+    """
+    def __init__(self, file_name, chunk_rows=8192):
+        self.file_name = file_name
+        self.chunk_rows = chunk_rows
+
+        self._fh = open(file_name, 'ab')
+        self._types_fh = open(file_name + '.types', 'a')
+        self._type_index = {}
+        self._rows = []
+
+    def append(self, frame, vehicle_id, type_id, location, rotation, size):
+        """
+        Buffers the row of a vehicle.
+
+            :param location: x, y, z.
+            :param rotation: roll, pitch, yaw.
+            :param size: length, width, height.
+        """
+        type_index = self._type_index.get(type_id)
+        if type_index is None:
+            type_index = len(self._type_index)
+            self._type_index[type_id] = type_index
+            self._types_fh.write(type_id + '\n')
+        self._rows.append((frame, vehicle_id, type_index) + tuple(location) + tuple(rotation) + tuple(size))
+
+    def end_tick(self):
+        """
+        Flushes the buffered rows once they fill a chunk. Chunks only hold complete ticks.
+        """
+        if len(self._rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        rows = np.array(self._rows, dtype=TRAJECTORY_DTYPE)
+        self._rows = []
+
+        header = np.zeros(1, dtype=CHUNK_HEADER_DTYPE)
+        header['magic'] = TRAJECTORY_MAGIC
+        header['n_rows'] = len(rows)
+        header['first_frame'] = rows['frame'][0]
+        header['last_frame'] = rows['frame'][-1]
+        # The types of the chunk must be on disk before the chunk.
+        self._types_fh.flush()
+        self._fh.write(header.tobytes())
+        for name in TRAJECTORY_DTYPE.names:
+            self._fh.write(np.ascontiguousarray(rows[name]).tobytes())
+        self._fh.flush()
+
+    def close(self):
+        """
+        Writes the remaining rows and the frame index.
+        """
+        self.flush()
+        self._fh.close()
+        self._types_fh.close()
+        np.save(self.file_name + '.idx.npy', _build_frame_index(read_trajectory(self.file_name)))
+
+
+def read_trajectory(file_name):
+    """
+    Reads all the rows of a trajectory file. A chunk truncated by a crash is ignored.
+        :returns: structured array of TRAJECTORY_DTYPE.
+    """
+    chunks = []
+    file_size = os.path.getsize(file_name)
+    row_size = TRAJECTORY_DTYPE.itemsize
+    with open(file_name, 'rb') as f:
+        offset = 0
+        while offset + CHUNK_HEADER_DTYPE.itemsize <= file_size:
+            header = np.fromfile(f, dtype=CHUNK_HEADER_DTYPE, count=1)[0]
+            if header['magic'] != TRAJECTORY_MAGIC:
+                raise ValueError('%s: invalid chunk at byte %d.' % (file_name, offset))
+            n_rows = int(header['n_rows'])
+            offset += CHUNK_HEADER_DTYPE.itemsize
+            if offset + n_rows * row_size > file_size:
+                break
+            rows = np.zeros(n_rows, dtype=TRAJECTORY_DTYPE)
+            for name in TRAJECTORY_DTYPE.names:
+                rows[name] = np.fromfile(f, dtype=TRAJECTORY_DTYPE[name], count=n_rows)
+            offset += n_rows * row_size
+            chunks.append(rows)
+    if not chunks:
+        return np.zeros(0, dtype=TRAJECTORY_DTYPE)
+    return np.concatenate(chunks)
+
+
+def read_types(file_name):
+    """
+    Returns the vehicle type ids of a trajectory file, indexed by the 'type_index' column.
+    """
+    with open(file_name + '.types') as f:
+        return [line.rstrip('\n') for line in f]
+
+
+def _build_frame_index(rows):
+    frames, first_rows, counts = np.unique(rows['frame'], return_index=True, return_counts=True)
+    index = np.zeros(len(frames), dtype=FRAME_INDEX_DTYPE)
+    index['frame'] = frames
+    index['row'] = first_rows
+    index['count'] = counts
+    return index
+
+
+class TrajectoryReader(object):
+    """
+    TrajectoryReader loads a trajectory file and its frame index.
+    """
+    def __init__(self, file_name):
+        self.rows = read_trajectory(file_name)
+        self.types = read_types(file_name)
+
+        # The index is rebuilt in memory if the run did not close the recorder properly.
+        index_file = file_name + '.idx.npy'
+        index = np.load(index_file) if os.path.exists(index_file) else None
+        if index is None or int(index['count'].sum()) != len(self.rows):
+            index = _build_frame_index(self.rows)
+        self.index = index
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def frames(self):
+        return self.index['frame']
+
+    def get_frame(self, frame):
+        """
+        Returns the rows of all the vehicles of the given frame (empty if the frame is unknown).
+        """
+        i = np.searchsorted(self.index['frame'], frame)
+        if i == len(self.index) or self.index['frame'][i] != frame:
+            return self.rows[:0]
+        row = int(self.index['row'][i])
+        return self.rows[row:row + int(self.index['count'][i])]
+
+    def type_ids(self, rows):
+        return [self.types[i] for i in rows['type_index']]
+
+
+def format_info_row(frame, type_id, vehicle_id, values):
+    """
+    Formats a row of the legacy info.csv: frame, type id, vehicle id, x, y, z, roll, pitch, yaw,
+    length, width, height.
+    """
+    return ['{:06}'.format(frame), type_id, str(vehicle_id)] + ['%.3f' % value for value in values]
@@ -1,34 +1,17 @@
 import pygame
 import numpy as np
 from PIL import Image
-from matplotlib import cm
 import open3d as o3d
 import carla
 import os
 from util.color_encoding import LABEL_COLORS
+from util.pointcloud_io import SEMANTIC_LIDAR_DTYPE, write_raw_bin
+from util.vis import intensity_to_color
+from util.image_io import DEFAULT_ENCODER, write_image
+from util.sumo_cfg import write_sumocfg
 cc = carla.ColorConverter.CityScapesPalette
 
 
-#######################Sumo#############################
-def write_sumocfg(path, junction):
-    cfg_str = """<?xml version="1.0" encoding="UTF-8"?>
-    <configuration xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/sumoConfiguration.xsd">
-
-        <input>
-            <net-file value="Town05.net.xml"/>
-            <route-files value="../carlavtypes.rou.xml,{}/route.rou.xml"/>
-            <additional-files value="{}/rerouter.add.xml"/>
-        </input>
-    
-        <gui_only>
-            <gui-settings-file value="../viewsettings.xml"/>
-        </gui_only>
-
-    </configuration>
-    """.format(junction, junction)
-    with open(path, 'w') as f:
-        f.write(cfg_str)
-
 #######################Carla#############################
 def get_blueprint(keywords, bp_lib, cfg):
     blp = bp_lib.find(keywords)
@@ -68,31 +51,32 @@ def carla_sensor_callback(data, sensor_queue, sensor_name, sensor_id, parent_id)
     sensor_queue.put((sensor_name, sensor_id, parent_id, data))
 
 
-def image_callback(image, file_name=None, is_annotation=False):
-    if is_annotation:
+def image_callback(image, file_name=None, is_annotation=False, meta_writer=None, encoder=DEFAULT_ENCODER,
+                   label_map=False):
+    # With label_map=True, semantic images are saved as single channel label maps (the tag is in
+    # the red channel of the BGRA buffer) without palette conversion, see util.image_io.labels_to_palette
+    if is_annotation and not label_map:
         image.convert(cc)
     array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
     if np.all(array==0):
         return
     array = np.reshape(array, (image.height, image.width, 4))
-    array = array[:, :, :3]
-    img_out = Image.fromarray(array)
+    if is_annotation and label_map:
+        array = array[:, :, 2]
+    else:
+        array = array[:, :, :3]
     if file_name is not None:
-        img_out.save(file_name)
-    write_image_meta_info(file_name, image)
+        write_image(array, file_name, encoder)
+    (meta_writer or write_image_meta_info)(file_name, image)
     # sensor_queue.put((image.frame, sensor_name))
 
 
 #######################Point cloud#############################
 
 
-VIRIDIS = np.array(cm.get_cmap('plasma').colors)
-VID_RANGE = np.linspace(0.0, 1.0, VIRIDIS.shape[0])
-
-
 def write_lidar_meta_info(filename, point_cloud):
     file_path, name = filename.rsplit('/', 1)
-    name = name[:-4] + '_meta.txt'
+    name = os.path.splitext(name)[0] + '_meta.txt'
     file_meta = os.path.join(file_path, name)
     with open(file_meta, 'w') as f:
         lines = []
@@ -111,7 +95,7 @@ def write_lidar_meta_info(filename, point_cloud):
 
 def write_image_meta_info(filename, image_data):
     file_path, name = filename.rsplit('/', 1)
-    name = name[:-4] + '_meta.txt'
+    name = os.path.splitext(name)[0] + '_meta.txt'
     file_meta = os.path.join(file_path, name)
     with open(file_meta, 'w') as f:
         lines = []
@@ -128,18 +112,23 @@ def write_image_meta_info(filename, image_data):
         f.write('\n'.join(lines))
 
 
-def pointcloud_callback(point_cloud, file_name=None, blend=False):
+def pointcloud_callback(point_cloud, file_name=None, blend=False, meta_writer=None, file_format='pcd'):
+    # With file_format='bin' the raw x, y, z, intensity buffer is written as is, without copy and
+    # colorization (see util.pointcloud_io, util.vis.read_lidar_bin_colored)
+    if file_format == 'bin':
+        if np.all(np.frombuffer(point_cloud.raw_data, dtype=np.dtype('f4')) == 0):
+            return
+        write_raw_bin(point_cloud, file_name)
+        (meta_writer or write_lidar_meta_info)(file_name, point_cloud)
+        return
+
     data = np.copy(np.frombuffer(point_cloud.raw_data, dtype=np.dtype('f4')))
     if np.all(data==0):
         return
     data = np.reshape(data, (int(data.shape[0] / 4), 4))
     # Isolate the intensity and compute a color for it
     intensity = data[:, -1]
-    intensity_col = 1.0 - np.log(intensity) / np.log(np.exp(-0.004 * 100))
-    int_color = np.c_[
-        np.interp(intensity_col, VID_RANGE, VIRIDIS[:, 0]),
-        np.interp(intensity_col, VID_RANGE, VIRIDIS[:, 1]),
-        np.interp(intensity_col, VID_RANGE, VIRIDIS[:, 2])]
+    int_color = intensity_to_color(intensity)
 
     # Isolate the 3D data
     points = data[:, :-1]
@@ -158,17 +147,22 @@ def pointcloud_callback(point_cloud, file_name=None, blend=False):
     point_list.colors = o3d.utility.Vector3dVector(int_color)
     o3d.io.write_point_cloud(file_name, point_list)
     # write meta data
-    write_lidar_meta_info(file_name, point_cloud)
+    (meta_writer or write_lidar_meta_info)(file_name, point_cloud)
 
     # sensor_queue.put((point_cloud.frame, sensor_name))
 
 
-def semantic_lidar_callback(point_cloud, file_name=None):
+def semantic_lidar_callback(point_cloud, file_name=None, file_format='pcd', meta_writer=None):
     """Prepares a point cloud with semantic segmentation
-    colors ready to be consumed by Open3D"""
-    data = np.frombuffer(point_cloud.raw_data, dtype=np.dtype([
-        ('x', np.float32), ('y', np.float32), ('z', np.float32),
-        ('CosAngle', np.float32), ('ObjIdx', np.uint32), ('ObjTag', np.uint32)]))
+    colors ready to be consumed by Open3D. With file_format='bin' the raw
+    carla buffer is written as is (see util.pointcloud_io)"""
+    data = np.frombuffer(point_cloud.raw_data, dtype=SEMANTIC_LIDAR_DTYPE)
+    if file_format == 'bin':
+        if np.all(data['x'] == 0) and np.all(data['y'] == 0) and np.all(data['z'] == 0):
+            return
+        write_raw_bin(point_cloud, file_name)
+        (meta_writer or write_lidar_meta_info)(file_name, point_cloud)
+        return
 
     # We're negating the y to correclty visualize a world that matches
     # what we see in Unreal since Open3D uses a right-handed coordinate system
@@ -192,7 +186,7 @@ def semantic_lidar_callback(point_cloud, file_name=None):
     o3d.io.write_point_cloud(file_name, point_list)
 
     # write meta data
-    write_lidar_meta_info(file_name, point_cloud)
+    (meta_writer or write_lidar_meta_info)(file_name, point_cloud)
 
     # sensor_queue.put((point_cloud.frame, sensor_name))
 
@@ -1,8 +1,32 @@
 import numpy as np
 import open3d as o3d
 import matplotlib.pyplot as plt
-import os
 from glob import glob
+from matplotlib import cm
+from util.pointcloud_io import read_lidar_bin
+
+VIRIDIS = np.array(cm.get_cmap('plasma').colors)
+VID_RANGE = np.linspace(0.0, 1.0, VIRIDIS.shape[0])
+
+
+def intensity_to_color(intensity):
+    """Maps lidar intensities to the plasma colormap (N x 3, float64 in [0, 1])"""
+    intensity_col = 1.0 - np.log(intensity) / np.log(np.exp(-0.004 * 100))
+    return np.c_[
+        np.interp(intensity_col, VID_RANGE, VIRIDIS[:, 0]),
+        np.interp(intensity_col, VID_RANGE, VIRIDIS[:, 1]),
+        np.interp(intensity_col, VID_RANGE, VIRIDIS[:, 2])]
+
+
+def read_lidar_bin_colored(file_name):
+    """Reads a raw lidar '.bin' file as an Open3D cloud colored by intensity, with the x axis
+    negated as in the '.pcd' files"""
+    data = read_lidar_bin(file_name)
+    points = np.stack([-data['x'], data['y'], data['z']], axis=1).astype(np.float64)
+    cloud = o3d.geometry.PointCloud()
+    cloud.points = o3d.utility.Vector3dVector(points)
+    cloud.colors = o3d.utility.Vector3dVector(intensity_to_color(data['intensity']))
+    return cloud
 
 
 def draw_points_2d(file_name):
@@ -1,6 +1,7 @@
 from pathlib import Path
 import os
-from scripts.python.formatting_data import read_meta_info
+from scripts.python.formatting_data import read_meta_info, read_meta_log_info
+from util.meta_log import MetaLogReader
 
 path = Path('/media/hdd/yuan/koko/data/simulation2/j1148')
 # find all valid frames of ego vehicle and the corresponding neighbors
@@ -20,16 +21,25 @@ ego = '000255'
 listdirs = path.glob('*/')
 vehicles = []
 for d in listdirs:
-    if 'csv' not in str(d):
+    if d.is_dir():
         vehicles.append(d.name)
 
-for frame_file in (path / ego).glob('lidar_sem/*.txt'):
-    frame_file_nbr = str(frame_file).rsplit('/', 3)
-    frame = frame_file_nbr[-1][:-9]
+# meta information is either in '_meta.txt' files or in the binary meta log of the junction
+meta_log = MetaLogReader(str(path / 'meta.bin')) if (path / 'meta.bin').exists() else None
+if meta_log is not None:
+    frames = ['%06d' % f for f in meta_log.select(parent_id=int(ego), sensor_name='lidar_sem')['frame']]
+else:
+    frames = [f.name[:-9] for f in (path / ego).glob('lidar_sem/*.txt')]
+
+for frame in frames:
     for v in vehicles:
-        frame_file_nbr[1] = v
-        if os.path.exists('/'.join(frame_file_nbr)):
-            metas = read_meta_info('/'.join(frame_file_nbr))
+        metas = None
+        if meta_log is not None:
+            if meta_log.find(int(frame), int(v), 'lidar_sem') is not None:
+                metas = read_meta_log_info(meta_log, str(path / v / 'lidar_sem' / (frame + '.bin')))
+        elif os.path.exists(str(path / v / 'lidar_sem' / (frame + '_meta.txt'))):
+            metas = read_meta_info(str(path / v / 'lidar_sem' / (frame + '_meta.txt')))
+        if metas is not None:
             sensor_height = float(metas[2][2])
             vehicle_height = float(info_dict[frame][v[3:]][-1])
             location_height = float(info_dict[frame][v[3:]][2])